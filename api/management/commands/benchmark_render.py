@@ -0,0 +1,178 @@
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from PIL import Image, ImageDraw
+
+from api.utils.encryption import encrypt_bytes
+from api.utils.derivatives import generate_derivatives
+from api.utils.video import render_progress_video, render_stats
+from progress_tracking.models import Category, ProgressImage, VideoRenderJob
+from user.models import CustomUser
+
+# Phone camera landscape/portrait, 1080p screenshot, older camera
+RESOLUTIONS = [(4032, 3024), (3024, 4032), (1920, 1080), (1280, 960)]
+
+
+def synthetic_photo(index, size):
+    """
+    A JPEG with smooth gradients and some edges, so it compresses roughly like a photo.
+    """
+    frame = Image.radial_gradient("L").resize(size).convert("RGB")
+    tint = Image.new("RGB", size, ((index * 37) % 256, (index * 91) % 256, 160))
+    frame = Image.blend(frame, tint, 0.5)
+    draw = ImageDraw.Draw(frame)
+    w, h = size
+    draw.ellipse((w // 4, h // 4, w * 3 // 4, h * 3 // 4), outline=(255, 255, 255), width=max(2, w // 100))
+    draw.text((w // 10, h // 10), f"frame {index}", fill=(0, 0, 0))
+    buf = io.BytesIO()
+    frame.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux. This process only: RUSAGE_CHILDREN would report
+    # the forked copy of this process from before ffmpeg's exec, not ffmpeg.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks progress video rendering on synthetic timelines against local "
+        "filesystem storage and prints the results as JSON. Each scenario runs in "
+        "a throwaway test database, never the configured one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--frames",
+            type=int,
+            nargs="+",
+            default=[10, 100, 500],
+            help="Timeline lengths to benchmark.",
+        )
+        parser.add_argument("--fps", type=float, default=2.0)
+        parser.add_argument("--width", type=int, default=720)
+        parser.add_argument("--height", type=int, default=1280)
+        parser.add_argument(
+            "--with-derivatives",
+            action="store_true",
+            help="Generate thumbnails/video frames before rendering, as the derivative worker would.",
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+        parser.add_argument(
+            "--single",
+            type=int,
+            help="Internal: run one scenario in this process and print its result.",
+        )
+
+    def handle(self, *args, **options):
+        if options["single"]:
+            result = self.run_scenario(options["single"], options)
+            self.stdout.write(json.dumps(result))
+            return
+
+        # One process per scenario so peak RSS is not carried over between them
+        report = {
+            "params": {
+                "fps": options["fps"],
+                "width": options["width"],
+                "height": options["height"],
+                "with_derivatives": options["with_derivatives"],
+                "prefetch_workers": settings.RENDER_PREFETCH_WORKERS,
+                "segment_cache": settings.RENDER_SEGMENT_CACHE,
+            },
+            "scenarios": [],
+        }
+        for frames in options["frames"]:
+            cmd = [
+                sys.executable, os.path.join(settings.BASE_DIR, "manage.py"), "benchmark_render",
+                "--single", str(frames),
+                "--fps", str(options["fps"]),
+                "--width", str(options["width"]),
+                "--height", str(options["height"]),
+            ]
+            if options["with_derivatives"]:
+                cmd.append("--with-derivatives")
+            self.stderr.write(f"Rendering {frames} frames...")
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            report["scenarios"].append(json.loads(out.strip().splitlines()[-1]))
+
+        data = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                fh.write(data + "\n")
+        else:
+            self.stdout.write(data)
+
+    def run_scenario(self, frames, options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        workdir = tempfile.mkdtemp(prefix="render_bench_")
+        old_cwd = os.getcwd()
+        os.chdir(workdir)  # renders are written relative to the working directory
+        try:
+            return self.render_in(workdir, frames, options)
+        finally:
+            os.chdir(old_cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def render_in(self, workdir, frames, options):
+        storages = {
+            **settings.STORAGES,
+            "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        }
+        # Local storage only: keep the rendered video on disk rather than streaming it to the bucket
+        with override_settings(MEDIA_ROOT=workdir, STORAGES=storages, STREAMING_UPLOADS=False):
+            user = CustomUser.objects.create_user(
+                username=f"bench{os.getpid()}",
+                email=f"bench{os.getpid()}@example.com",
+            )
+            category, _ = Category.objects.get_or_create(name="Benchmark")
+
+            source_bytes = 0
+            for i in range(frames):
+                data = encrypt_bytes(synthetic_photo(i, RESOLUTIONS[i % len(RESOLUTIONS)]), user)
+                source_bytes += len(data)
+                img = ProgressImage.objects.create(
+                    user=user,
+                    category=category,
+                    image=ContentFile(data, name=f"bench_{i}.jpg"),
+                )
+                if options["with_derivatives"]:
+                    generate_derivatives(img)
+
+            job = VideoRenderJob.objects.create(
+                user=user,
+                category=category,
+                params={"fps": options["fps"], "width": options["width"], "height": options["height"]},
+            )
+
+            render_stats.reset()
+            started = time.perf_counter()
+            video, result = render_progress_video(job)
+            wall = time.perf_counter() - started
+
+            report = {
+                "frames": frames,
+                "wall_s": round(wall, 3),
+                "frames_per_s": round(frames / wall, 2),
+                "source_mb": round(source_bytes / 2 ** 20, 2),
+                "video_mb": round(os.path.getsize(video.video.name) / 2 ** 20, 2),
+                "peak_rss_mb": peak_rss_mb(),
+                "stages": render_stats.snapshot(),
+            }
+
+        return report
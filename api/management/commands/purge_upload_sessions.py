@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils.timezone import now
+
+from api.utils.resumable import discard_session
+from progress_tracking.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes resumable upload sessions (and their stored chunks) that were never "
+        "completed, including ones whose completion request died while assembling."
+    )
+
+    def handle(self, *args, **options):
+        cutoff = now() - timedelta(seconds=settings.RESUMABLE_UPLOAD_EXPIRES)
+        stuck = now() - timedelta(seconds=settings.RESUMABLE_UPLOAD_ASSEMBLE_TIMEOUT)
+        stale = UploadSession.objects.filter(
+            Q(assembling=False, created_at__lt=cutoff)
+            | Q(assembling=True, assembling_since__lt=stuck)
+            # Claimed before assembling_since was recorded
+            | Q(assembling=True, assembling_since__isnull=True, created_at__lt=cutoff)
+        )
+        count = 0
+        for session in stale.iterator():
+            discard_session(session)
+            count += 1
+        self.stdout.write(f"Purged {count} upload sessions.")
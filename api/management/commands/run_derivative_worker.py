@@ -0,0 +1,117 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.utils.jobs import claim_next_derivative_image, requeue_derivative_image, run_derivative_job
+from api.utils.workers import init_worker
+from progress_tracking.models import ProgressImage
+
+logger = logging.getLogger(__name__)
+
+
+def process_image(image_id):
+    img = ProgressImage.objects.select_related("user").filter(id=image_id).first()
+    if img is None:
+        # Deleted since it was claimed
+        return image_id, None
+    img = run_derivative_job(img)
+    return img.id, img.derivatives_status
+
+
+class Command(BaseCommand):
+    help = "Generates thumbnails and video frames for newly uploaded progress images."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process at most one image and exit.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.RENDER_WORKER_POLL_INTERVAL,
+            help="Seconds to sleep when there is nothing to do.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.DERIVATIVE_WORKERS,
+            help="Images processed in parallel, each in its own process.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Derivative worker started.")
+        if options["workers"] > 1 and not options["once"]:
+            return self.run_pool(options["workers"], options["poll_interval"])
+
+        while True:
+            img = claim_next_derivative_image()
+            if img is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+
+            img = run_derivative_job(img)
+            self.stdout.write(f"Progress image {img.id}: derivatives {img.derivatives_status}")
+
+            if options["once"]:
+                return
+
+    def run_pool(self, workers, poll_interval):
+        while True:
+            # A worker dying (OOM, a crashing decoder) breaks the whole pool; carry on with a new one
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+                self.feed_pool(pool, workers, poll_interval)
+            self.stderr.write("Worker pool broke; starting a new one.")
+
+    def feed_pool(self, pool, workers, poll_interval):
+        """
+        Claims images and processes them on pool until the pool breaks. Images
+        are claimed here; workers open their own connections.
+        """
+        pending = {}
+        broken = False
+        while not broken:
+            while len(pending) < workers:
+                img = claim_next_derivative_image()
+                if img is None:
+                    break
+                try:
+                    pending[pool.submit(process_image, img.id)] = img.id
+                except BrokenProcessPool:
+                    requeue_derivative_image(img.id)
+                    broken = True
+                    break
+
+            if not pending:
+                if not broken:
+                    time.sleep(poll_interval)
+                continue
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                image_id = pending.pop(future)
+                try:
+                    _, derivatives_status = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    requeue_derivative_image(image_id)
+                    continue
+                except Exception:
+                    logger.exception("Derivatives for progress image %s failed in the pool", image_id)
+                    requeue_derivative_image(image_id)
+                    continue
+                if derivatives_status is None:
+                    self.stdout.write(f"Progress image {image_id}: deleted, skipped")
+                else:
+                    self.stdout.write(f"Progress image {image_id}: derivatives {derivatives_status}")
+
+        # Everything else that was running in the broken pool is lost too
+        for image_id in pending.values():
+            requeue_derivative_image(image_id)
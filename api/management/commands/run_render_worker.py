@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.utils.admission import render_slot
+from api.utils.jobs import claim_next_render_job, run_render_job
+
+
+class Command(BaseCommand):
+    help = "Processes queued progress video render jobs. Run one per CPU you want to spend on rendering."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process at most one job and exit.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.RENDER_WORKER_POLL_INTERVAL,
+            help="Seconds to sleep when the queue is empty.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Render worker started.")
+        while True:
+            with render_slot() as slot:
+                # All host render slots busy → behave like an empty queue
+                job = claim_next_render_job() if slot is not None else None
+                if job is not None:
+                    self.stdout.write(f"Rendering job {job.id} for {job.user.username} (slot {slot})...")
+                    started = time.monotonic()
+                    job = run_render_job(job)
+                    self.stdout.write(f"Job {job.id} {job.status} in {time.monotonic() - started:.1f}s")
+
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+
+            if options["once"]:
+                return
@@ -8,6 +8,8 @@ from user.models import CustomUser
 import base64
 from django.core.files.base import ContentFile
 
+from .utils.uploads import StoredUpload
+
 class RegisterSerializer(serializers.ModelSerializer):
     password2 = serializers.CharField(write_only=True)  # ✅ Added this line
     profile_picture = serializers.ImageField(required=False)
@@ -45,7 +47,23 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ["id", "name"]
 
 
+class EncryptedImageField(serializers.ImageField):
+    """
+    Accepts uploads that EncryptingUploadHandler already encrypted and stored
+    (their content was checked while streaming); anything else is validated as usual.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, StoredUpload):
+            if data.error:
+                raise serializers.ValidationError(data.error)
+            return data
+        return super().to_internal_value(data)
+
+
 class ProgressImageSerializer(serializers.ModelSerializer):
+    image = EncryptedImageField()
+
     class Meta:
         model = ProgressImage
         fields = ['id', 'image', 'category', 'date']
@@ -1,3 +1,1030 @@
-from django.test import TestCase
+import base64
+import io
+import os
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import imageio_ffmpeg
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api.management.commands import run_derivative_worker
+from api.utils import hls, jobs, resumable, rotation, uploads, wasabi
+from api.utils.admission import RenderRejected, admit_render, release_render
+from api.utils.encryption import (
+    HEADER, MAGIC, MAX_HEADER_SIZE, TAG_SIZE, ChunkLayout, StreamEncryptor, chunk_nonce,
+    decrypt_bytes, encrypt_bytes, encrypted_size, get_stream_key, header_key_version,
+    key_cache, rotate_user_key,
+)
+from api.utils.jobs import (
+    claim_next_derivative_image, claim_next_render_job, requeue_derivative_image, run_render_job,
+)
+from api.utils.video import (
+    RenderError, decode_frame, encode_frames, encode_timeline, prefetch_frames, segment_chain_keys,
+)
+from api.views import UNSATISFIABLE, parse_byte_range
+from progress_tracking.models import (
+    Category, MediaObject, ProgressImage, ProgressVideo, RenderQuota, UploadSession, VideoRenderJob, VideoSegment,
+)
+from user.models import CustomUser
+
+CHUNK = 64
+SEALED = CHUNK + TAG_SIZE
+
+
+class FakeBucket:
+    """
+    Just enough of an S3 client / the wasabi helpers to run storage code against a dict.
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self.objects[Key]
+        if Range is None:
+            return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+        start, end = map(int, Range.split("=")[1].split("-"))
+        end = min(end, len(data) - 1)
+        return {"Body": io.BytesIO(data[start:end + 1]), "ContentRange": f"bytes {start}-{end}/{len(data)}"}
+
+    def read_object_head(self, key, size):
+        return self.objects[key][:size]
+
+    def open_object(self, key):
+        return io.BytesIO(self.objects[key])
+
+    def upload_object(self, key, fileobj):
+        self.objects[key] = fileobj.read()
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+class FakeMultipartS3:
+    """
+    Records the multipart upload calls EncryptedMultipartUpload makes; completed uploads land in `objects`.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.parts = {}
+        self.objects = {}
+
+    def create_multipart_upload(self, Bucket, Key, **extra):
+        self.calls.append(("create", Key))
+        self.parts[Key] = []
+        return {"UploadId": Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append(("part", Key))
+        self.parts[Key].append(Body)
+        return {"ETag": str(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append(("complete", Key))
+        self.objects[Key] = b"".join(self.parts.pop(Key))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append(("abort", Key))
+        del self.parts[Key]
+
+
+def encrypt_v1(data, user, chunk_size=CHUNK):
+    """
+    A version 1 container (stream key derived from the user's Fernet key), as written before envelopes.
+    """
+    prefix = os.urandom(7)
+    aad = HEADER.pack(MAGIC, 1, chunk_size, prefix)
+    aead = AESGCM(get_stream_key(user))
+    pieces = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)] or [b""]
+    return aad + b"".join(
+        aead.encrypt(chunk_nonce(prefix, i, i == len(pieces) - 1), piece, aad)
+        for i, piece in enumerate(pieces)
+    )
+
+
+@override_settings(
+    ENCRYPTION_CHUNK_SIZE=CHUNK,
+    ENCRYPTION_MASTER_KEY=base64.urlsafe_b64encode(b"m" * 32).decode(),
+)
+class ChunkedContainerTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="crypto", email="crypto@example.com")
+        # Ids are reused between tests; don't pick up another test's keyring
+        key_cache.discard(("keyring", self.user.id))
+
+    def test_round_trip_across_chunk_boundaries(self):
+        for size in (0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 2 * CHUNK, 3 * CHUNK + 5):
+            data = os.urandom(size)
+            sealed = encrypt_bytes(data, self.user)
+            self.assertEqual(len(sealed), encrypted_size(size))
+            self.assertEqual(decrypt_bytes(sealed, self.user), data)
+
+    def test_stream_encryptor_accepts_pieces_of_any_size(self):
+        data = os.urandom(5 * CHUNK + 3)
+        encryptor = StreamEncryptor(self.user)
+        out = [encryptor.header]
+        for start, length in ((0, 1), (1, 7), (8, 150), (158, 0), (158, 200)):
+            out.append(encryptor.update(data[start:start + length]))
+        out.append(encryptor.finalize())
+        self.assertEqual(decrypt_bytes(b"".join(out), self.user), data)
+
+    def test_tampered_body_is_rejected(self):
+        sealed = bytearray(encrypt_bytes(os.urandom(3 * CHUNK), self.user))
+        sealed[MAX_HEADER_SIZE + SEALED + 5] ^= 1
+        with self.assertRaises(InvalidTag):
+            decrypt_bytes(bytes(sealed), self.user)
+
+    def test_tampered_header_is_rejected(self):
+        sealed = bytearray(encrypt_bytes(os.urandom(2 * CHUNK), self.user))
+        sealed[HEADER.size - 1] ^= 1  # nonce prefix, authenticated with every chunk
+        with self.assertRaises(InvalidTag):
+            decrypt_bytes(bytes(sealed), self.user)
+
+    def test_truncation_is_rejected(self):
+        sealed = encrypt_bytes(os.urandom(3 * CHUNK), self.user)
+        # Dropping whole trailing chunks leaves a chunk that wasn't sealed as the last one
+        for cut in (SEALED, 2 * SEALED, 7):
+            with self.assertRaises(InvalidTag):
+                decrypt_bytes(sealed[:-cut], self.user)
+
+    def test_reordered_chunks_are_rejected(self):
+        sealed = encrypt_bytes(os.urandom(3 * CHUNK), self.user)
+        body = sealed[MAX_HEADER_SIZE:]
+        swapped = sealed[:MAX_HEADER_SIZE] + body[SEALED:2 * SEALED] + body[:SEALED] + body[2 * SEALED:]
+        with self.assertRaises(InvalidTag):
+            decrypt_bytes(swapped, self.user)
+
+    def test_chunks_cannot_move_between_objects(self):
+        data = os.urandom(2 * CHUNK)
+        first = encrypt_bytes(data, self.user)
+        second = encrypt_bytes(data, self.user)
+        mixed = first[:MAX_HEADER_SIZE + SEALED] + second[MAX_HEADER_SIZE + SEALED:]
+        with self.assertRaises(InvalidTag):
+            decrypt_bytes(mixed, self.user)
+
+    def test_v1_is_reencrypted_then_rewrapped(self):
+        bucket = FakeBucket()
+        data = os.urandom(3 * CHUNK + 9)
+        bucket.objects["obj"] = encrypt_v1(data, self.user)
+        self.assertEqual(decrypt_bytes(bucket.objects["obj"], self.user), data)
+
+        with mock.patch.multiple(
+            rotation,
+            read_object_head=bucket.read_object_head,
+            open_object=bucket.open_object,
+            upload_object=bucket.upload_object,
+        ):
+            action, _ = rotation.reencrypt_object("obj", self.user)
+            self.assertEqual(action, rotation.REENCRYPTED)
+            v2 = bucket.objects["obj"]
+            self.assertEqual(v2[4], 2)
+            self.assertEqual(header_key_version(v2), 1)
+            self.assertEqual(decrypt_bytes(v2, self.user), data)
+
+            self.assertEqual(rotation.reencrypt_object("obj", self.user)[0], rotation.SKIPPED)
+
+            new_version = rotate_user_key(self.user)
+            action, _ = rotation.reencrypt_object("obj", self.user)
+            self.assertEqual(action, rotation.REWRAPPED)
+            rewrapped = bucket.objects["obj"]
+            self.assertEqual(header_key_version(rewrapped), new_version)
+            # Only the wrapped data key changes; the body is copied through
+            self.assertEqual(rewrapped[:HEADER.size], v2[:HEADER.size])
+            self.assertEqual(rewrapped[MAX_HEADER_SIZE:], v2[MAX_HEADER_SIZE:])
+            self.assertEqual(decrypt_bytes(rewrapped, self.user), data)
+
+    def test_decrypted_range_at_chunk_edges(self):
+        bucket = FakeBucket()
+        data = os.urandom(4 * CHUNK + 10)
+        bucket.objects["obj"] = encrypt_bytes(data, self.user)
+        last = len(data) - 1
+
+        with mock.patch.object(wasabi, "get_s3_client", return_value=bucket):
+            layout = wasabi.get_chunk_layout("obj")
+            self.assertEqual(layout.plain_size, len(data))
+            for start, end in (
+                (0, 0), (0, CHUNK - 1), (CHUNK - 1, CHUNK), (CHUNK, CHUNK), (CHUNK, 2 * CHUNK - 1),
+                (2 * CHUNK - 1, 3 * CHUNK), (4 * CHUNK, last), (last, last), (0, last),
+            ):
+                self.assertEqual(
+                    wasabi.get_decrypted_range("obj", layout, self.user, start, end),
+                    data[start:end + 1],
+                    (start, end),
+                )
+
+    def test_layout_of_v1_container(self):
+        data = os.urandom(2 * CHUNK + 1)
+        sealed = encrypt_v1(data, self.user)
+        layout = ChunkLayout(sealed, len(sealed))
+        self.assertEqual(layout.plain_size, len(data))
+        offset, length = layout.span(CHUNK, 2 * CHUNK)
+        self.assertEqual(
+            layout.decrypt_span(sealed[offset:offset + length], CHUNK, 2 * CHUNK, self.user),
+            data[CHUNK:2 * CHUNK + 1],
+        )
+
+
+class EncodeFramesTests(TestCase):
+    def test_fractional_fps_keeps_every_frame(self):
+        colors = [(i * 30, 0, 255 - i * 30) for i in range(8)]
+        with tempfile.TemporaryDirectory() as tmp:
+            out_path = os.path.join(tmp, "out.mp4")
+            count, size = encode_frames((Image.new("RGB", (64, 48), c) for c in colors), out_path, 2.5)
+            self.assertEqual((count, size), (8, (64, 48)))
+            frames, _ = imageio_ffmpeg.count_frames_and_secs(out_path)
+            # 8 photos at 2.5 fps is 3.2 s; at 3 fps output that is 10 frames (~3.33 s), none dropped
+            self.assertEqual(frames, 10)
+
+            decoded = imageio_ffmpeg.read_frames(out_path)
+            decoded.send(None)
+            seen = [bytes(frame[:3]) for frame in decoded]
+            for r, g, b in colors:
+                self.assertTrue(any(abs(p[0] - r) < 20 and abs(p[2] - b) < 20 for p in seen), (r, g, b))
+
+
+class DecodeFrameTests(TestCase):
+    def encode(self, image, fmt, **params):
+        out = io.BytesIO()
+        image.save(out, fmt, **params)
+        return out.getvalue()
+
+    def test_non_jpeg_modes_are_reduced_to_the_canvas(self):
+        palette = Image.new("RGB", (640, 480), (200, 30, 30)).convert("P", palette=Image.Palette.ADAPTIVE)
+        transparent = palette.copy()
+        transparent.info["transparency"] = 0
+        for data in (
+            self.encode(palette, "GIF"),
+            self.encode(palette, "PNG"),
+            self.encode(transparent, "PNG", transparency=0),
+            self.encode(Image.new("1", (640, 480), 1), "PNG"),
+            self.encode(Image.new("I;16", (640, 480), 1000), "PNG"),
+        ):
+            frame = decode_frame(data, (160, 90))
+            self.assertEqual(frame.mode, "RGB")
+            self.assertEqual(frame.size, (160, 90))
+
+    def test_palette_colors_survive_reduction(self):
+        palette = Image.new("RGB", (640, 480), (200, 30, 30)).convert("P", palette=Image.Palette.ADAPTIVE)
+        frame = decode_frame(self.encode(palette, "GIF"), (160, 120))
+        self.assertEqual(frame.getpixel((80, 60)), (200, 30, 30))
+
+
+@override_settings(RENDER_MAX_IN_FLIGHT_PER_USER=2, FREE_VIDEOS_PER_WEEK=3, RENDER_QUEUE_MAX=100)
+class RenderAdmissionTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="render", email="render@example.com")
+        self.category = Category.objects.create(name="Front")
+        ProgressImage.objects.create(user=self.user, category=self.category, image="progress_images/a.jpg")
+        RenderQuota.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def quota(self):
+        quota = RenderQuota.objects.get(user=self.user)
+        return quota.in_flight, quota.week_count
+
+    def create_video(self):
+        return self.client.post(reverse("progress-video-create"), {"category": "Front"})
+
+    def test_admit_and_release_counters(self):
+        admit_render(self.user)
+        admit_render(self.user)
+        self.assertEqual(self.quota(), (2, 2))
+        release_render(self.user.id)
+        self.assertEqual(self.quota(), (1, 2))
+        release_render(self.user.id, refund=True)
+        self.assertEqual(self.quota(), (0, 1))
+        # Never below zero
+        release_render(self.user.id, refund=True)
+        release_render(self.user.id, refund=True)
+        self.assertEqual(self.quota(), (0, 0))
+
+    def test_in_flight_limit_does_not_count_towards_the_week(self):
+        admit_render(self.user)
+        admit_render(self.user)
+        with self.assertRaises(RenderRejected) as ctx:
+            admit_render(self.user)
+        self.assertEqual(ctx.exception.status, 429)
+        self.assertEqual(self.quota(), (2, 2))
+
+    def test_weekly_limit_for_free_users(self):
+        for _ in range(3):
+            admit_render(self.user)
+            release_render(self.user.id)
+        with self.assertRaises(RenderRejected) as ctx:
+            admit_render(self.user)
+        self.assertEqual(ctx.exception.status, 403)
+        self.assertEqual(self.quota(), (0, 3))
+
+    def test_endpoint_returns_429_with_retry_after(self):
+        self.assertEqual(self.create_video().status_code, 202)
+        self.assertEqual(self.create_video().status_code, 202)
+        response = self.create_video()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        self.assertEqual(VideoRenderJob.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(self.quota(), (2, 2))
+
+    def test_failed_job_create_releases_the_slot(self):
+        with mock.patch.object(VideoRenderJob.objects, "create", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                self.create_video()
+        self.assertEqual(self.quota(), (0, 0))
+        self.assertEqual(self.create_video().status_code, 202)
+
+
+@override_settings(PROTECTED_MEDIA_MAX_RANGE=100)
+class ByteRangeTests(TestCase):
+    def test_open_ended_range_is_capped(self):
+        self.assertEqual(parse_byte_range("bytes=0-", 1000), (0, 99))
+        self.assertEqual(parse_byte_range("bytes=950-", 1000), (950, 999))
+
+    def test_explicit_range_is_capped(self):
+        self.assertEqual(parse_byte_range("bytes=10-19", 1000), (10, 19))
+        self.assertEqual(parse_byte_range("bytes=0-999", 1000), (0, 99))
+        self.assertEqual(parse_byte_range("bytes=500-5000", 1000), (500, 599))
+        self.assertEqual(parse_byte_range("bytes=990-5000", 1000), (990, 999))
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_byte_range("bytes=-10", 1000), (990, 999))
+        self.assertEqual(parse_byte_range("bytes=-500", 1000), (500, 599))
+        self.assertEqual(parse_byte_range("bytes=-5000", 50), (0, 49))
+
+    def test_out_of_bounds_range(self):
+        self.assertEqual(parse_byte_range("bytes=1000-", 1000), UNSATISFIABLE)
+        self.assertEqual(parse_byte_range("bytes=1000-1010", 1000), UNSATISFIABLE)
+        self.assertEqual(parse_byte_range("bytes=-0", 1000), UNSATISFIABLE)
+
+    def test_whole_resource_for_other_headers(self):
+        for header in (None, "", "items=0-10", "bytes=0-10,20-30", "bytes=a-b", "bytes=-", "bytes=20-10", "bytes=2000-10"):
+            self.assertIsNone(parse_byte_range(header, 1000), header)
+
+
+@override_settings(
+    ENCRYPTION_MASTER_KEY=base64.urlsafe_b64encode(b"m" * 32).decode(),
+    MEDIA_CACHE_DIR=None,
+)
+class GalleryTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="gallery", email="gallery@example.com")
+        key_cache.discard(("keyring", self.user.id))
+        category = Category.objects.create(name="Side")
+        self.images = [
+            ProgressImage.objects.create(
+                user=self.user, category=category, image=f"progress_images/{day}.jpg",
+                date=f"2026-03-{day:02d}T12:00:00Z",
+            )
+            for day in (1, 10, 20)
+        ]
+        ready = self.images[1]
+        ready.thumbnail = "progress_images/derivatives/10_thumb.jpg"
+        ready.derivatives_status = ProgressImage.DERIVATIVES_READY
+        ready.save()
+        storage = ProgressImage._meta.get_field("thumbnail").storage
+        patcher = mock.patch.object(storage, "open", side_effect=OSError("unreachable"))
+        self.storage_open = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, name, **params):
+        return self.client.get(reverse(name, args=["gallery", "Side"]), params)
+
+    def test_since_and_until_filter_both_views(self):
+        for name in ("user-category-progress", "gallery-manifest"):
+            response = self.get(name, since="2026-03-05", until="2026-03-20")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [img["id"] for img in response.json()["images"]],
+                [self.images[1].id, self.images[2].id],
+            )
+            for bad in ("March", "2026-02-30"):
+                self.assertEqual(self.get(name, since=bad).status_code, 400)
+
+    def test_manifest_inlines_private_thumbnails(self):
+        thumb = b"\xff\xd8thumbnail"
+        self.storage_open.side_effect = None
+        self.storage_open.return_value = ContentFile(encrypt_bytes(thumb, self.user))
+        images = self.get("gallery-manifest").json()["images"]
+        self.storage_open.assert_called_once_with("progress_images/derivatives/10_thumb.jpg", "rb")
+        self.assertEqual(
+            [img["thumbnail_data"] for img in images],
+            [None, "data:image/jpeg;base64," + base64.b64encode(thumb).decode(), None],
+        )
+        self.assertIsNone(images[0]["thumbnail"])
+        self.assertTrue(images[1]["thumbnail"].endswith("/10_thumb.jpg"))
+
+    @override_settings(GALLERY_INLINE_THUMBNAILS=0)
+    def test_thumbnails_past_the_inline_limit_are_not_fetched(self):
+        images = self.get("gallery-manifest").json()["images"]
+        self.storage_open.assert_not_called()
+        self.assertIsNone(images[1]["thumbnail_data"])
+        self.assertTrue(images[1]["thumbnail"].endswith("/10_thumb.jpg"))
+
+    def test_unreadable_thumbnail_falls_back_to_its_url(self):
+        response = self.get("gallery-manifest")
+        self.storage_open.assert_called_once()
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()["images"][1]["thumbnail_data"])
+
+
+@override_settings(
+    ENCRYPTION_MASTER_KEY=base64.urlsafe_b64encode(b"m" * 32).decode(),
+    MEDIA_CACHE_DIR=None,
+    PROTECTED_MEDIA_MAX_AGE=600,
+)
+class ProtectedMediaTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="owner", email="owner@example.com")
+        self.other = CustomUser.objects.create_user(username="other", email="other@example.com")
+        key_cache.discard(("keyring", self.user.id))
+        self.category = Category.objects.create(name="Chest")
+        self.image = ProgressImage.objects.create(
+            user=self.user, category=self.category, image="progress_images/mine.jpg"
+        )
+        self.data = b"\xff\xd8" + os.urandom(3000)
+        self.bucket = FakeBucket()
+        self.bucket.objects["progress_images/mine.jpg"] = encrypt_bytes(self.data, self.user)
+        patcher = mock.patch.object(wasabi, "get_s3_client", return_value=self.bucket)
+        self.s3_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, key, **headers):
+        return self.client.get(reverse("protected_media", args=[key]), headers=headers)
+
+    def registered(self):
+        return set(MediaObject.objects.values_list("key", "user_id", "kind"))
+
+    def test_owner_gets_the_decrypted_file(self):
+        response = self.get("progress_images/mine.jpg")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.data)
+
+    def test_matching_if_none_match_is_304_without_storage(self):
+        etag = self.get("progress_images/mine.jpg")["ETag"]
+        self.s3_client.reset_mock()
+        response = self.get("progress_images/mine.jpg", If_None_Match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertTrue(response["Cache-Control"].startswith("private"))
+        self.s3_client.assert_not_called()
+
+    def test_other_if_none_match_gets_the_file(self):
+        for validator in ('"deadbeef"', 'W/"deadbeef"'):
+            response = self.get("progress_images/mine.jpg", If_None_Match=validator)
+            self.assertEqual(response.status_code, 200, validator)
+            self.assertEqual(b"".join(response.streaming_content), self.data)
+
+    def test_if_range_must_match_strongly(self):
+        etag = self.get("progress_images/mine.jpg")["ETag"]
+        response = self.get("progress_images/mine.jpg", Range="bytes=10-19", If_Range=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, self.data[10:20])
+        self.assertTrue(response["Cache-Control"].startswith("private"))
+
+        for stale in ('"deadbeef"', "W/" + etag):
+            response = self.get("progress_images/mine.jpg", Range="bytes=10-19", If_Range=stale)
+            self.assertEqual(response.status_code, 200, stale)
+            self.assertNotIn("Content-Range", response)
+            self.assertEqual(b"".join(response.streaming_content), self.data)
+
+    def test_decrypted_responses_are_private(self):
+        response = self.get("progress_images/mine.jpg")
+        self.assertEqual(response["Cache-Control"], "private, max-age=600")
+        self.assertIn("Last-Modified", response)
+
+    def test_other_users_and_unregistered_keys_are_not_found(self):
+        ProgressImage.objects.create(user=self.other, category=self.category, image="progress_images/theirs.jpg")
+        self.bucket.objects["progress_images/theirs.jpg"] = b"secret"
+        for key in ("progress_images/theirs.jpg", "progress_images/unknown.jpg"):
+            self.assertEqual(self.get(key).status_code, 404, key)
+
+    def test_saves_and_deletes_keep_the_registry_in_sync(self):
+        video = ProgressVideo.objects.create(
+            user=self.user, category=self.category, video=f"progress_videos/{self.user.id}/v.mp4"
+        )
+        self.assertEqual(self.registered(), {
+            ("progress_images/mine.jpg", self.user.id, MediaObject.KIND_IMAGE),
+            (f"progress_videos/{self.user.id}/v.mp4", self.user.id, MediaObject.KIND_VIDEO),
+        })
+
+        self.image.image = "progress_images/retaken.jpg"
+        self.image.save()
+        self.assertEqual(
+            set(MediaObject.objects.filter(progress_image=self.image).values_list("key", flat=True)),
+            {"progress_images/retaken.jpg"},
+        )
+        self.assertEqual(self.get("progress_images/mine.jpg").status_code, 404)
+
+        self.image.delete()
+        video.delete()
+        self.assertFalse(MediaObject.objects.exists())
+
+    def test_key_is_never_moved_to_another_owner(self):
+        with self.assertLogs("progress_tracking.signals", "ERROR"):
+            ProgressImage.objects.create(user=self.other, category=self.category, image="progress_images/mine.jpg")
+        media = MediaObject.objects.get(key="progress_images/mine.jpg")
+        self.assertEqual((media.user_id, media.progress_image_id), (self.user.id, self.image.id))
+
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.get("progress_images/mine.jpg").status_code, 404)
+
+
+@override_settings(
+    ENCRYPTION_MASTER_KEY=base64.urlsafe_b64encode(b"m" * 32).decode(),
+    RESUMABLE_UPLOAD_EXPIRES=3600,
+    RESUMABLE_UPLOAD_ASSEMBLE_TIMEOUT=600,
+)
+class ResumableUploadTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="chunks", email="chunks@example.com")
+        key_cache.discard(("keyring", self.user.id))
+        self.category = Category.objects.create(name="Back")
+        self.bucket = FakeBucket()
+        patcher = mock.patch.multiple(
+            resumable,
+            upload_object=self.bucket.upload_object,
+            open_object=self.bucket.open_object,
+            get_s3_client=mock.Mock(return_value=self.bucket),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def new_session(self, **fields):
+        return UploadSession.objects.create(
+            user=self.user, category=self.category, file_name="a.jpg", content_type="image/jpeg",
+            size=2 * CHUNK, chunk_size=CHUNK, **fields
+        )
+
+    def put_chunk(self, session, index):
+        start = index * CHUNK
+        return self.client.generic(
+            "PUT", reverse("upload-session", args=[session.id]), os.urandom(CHUNK),
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{start + CHUNK - 1}/{2 * CHUNK}",
+        )
+
+    def complete(self, session):
+        return self.client.post(reverse("upload-session-complete", args=[session.id]))
+
+    def test_chunks_are_refused_while_assembling(self):
+        session = self.new_session()
+        self.assertEqual(self.put_chunk(session, 0).status_code, 200)
+        UploadSession.objects.filter(id=session.id).update(assembling=True, assembling_since=now())
+
+        response = self.put_chunk(session, 1)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(session.chunks.count(), 1)
+        self.assertEqual(len(self.bucket.objects), 1)
+
+    def test_second_complete_is_refused_while_the_first_runs(self):
+        session = self.new_session()
+        self.put_chunk(session, 0)
+        self.put_chunk(session, 1)
+        concurrent = {}
+        read_chunk = self.bucket.open_object
+
+        def open_object(key):
+            # The first request is assembling: a second one arrives now
+            if not concurrent:
+                concurrent["fresh"] = self.complete(session)
+                with self.assertRaises(resumable.UploadError) as ctx:
+                    resumable.assemble(session)  # stale copy that still reads assembling=False
+                concurrent["stale"] = ctx.exception.status
+            return read_chunk(key)
+
+        with mock.patch.object(resumable, "open_object", side_effect=open_object), \
+                mock.patch.object(resumable, "looks_like_image", return_value=False):
+            first = self.complete(session)
+
+        self.assertEqual(concurrent["fresh"].status_code, 409)
+        self.assertEqual(concurrent["stale"], 409)
+        # The first one failed on its own (not an image) and released the claim
+        self.assertEqual(first.status_code, 400)
+        session.refresh_from_db()
+        self.assertFalse(session.assembling)
+        self.assertIsNone(session.assembling_since)
+        self.assertEqual(session.chunks.count(), 2)
+
+    def test_purge_reclaims_stuck_sessions(self):
+        stuck = self.new_session()
+        self.assertEqual(self.put_chunk(stuck, 0).status_code, 200)
+        # Its complete request died mid-assembly and never released the claim
+        UploadSession.objects.filter(id=stuck.id).update(
+            assembling=True, assembling_since=now() - timedelta(seconds=601)
+        )
+        busy = self.new_session(assembling=True, assembling_since=now())
+        fresh = self.new_session()
+        expired = self.new_session()
+        UploadSession.objects.filter(id=expired.id).update(created_at=now() - timedelta(seconds=3601))
+        self.assertEqual(len(self.bucket.objects), 1)
+
+        call_command("purge_upload_sessions", stdout=io.StringIO())
+
+        self.assertEqual(
+            set(UploadSession.objects.values_list("id", flat=True)),
+            {busy.id, fresh.id},
+        )
+        self.assertEqual(self.bucket.objects, {})
+
+
+@override_settings(ENCRYPTION_MASTER_KEY=base64.urlsafe_b64encode(b"m" * 32).decode(), STREAMING_UPLOADS=True)
+class StreamingUploadDedupTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="dedup", email="dedup@example.com")
+        key_cache.discard(("keyring", self.user.id))
+        Category.objects.create(name="Arms")
+        self.s3 = FakeMultipartS3()
+        storage = ProgressImage._meta.get_field("image").storage
+        for patcher in (
+            mock.patch.object(uploads, "get_s3_client", return_value=self.s3),
+            mock.patch.object(storage, "delete"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.storage_delete = storage.delete
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def jpeg(self, color):
+        out = io.BytesIO()
+        Image.new("RGB", (32, 32), color).save(out, "JPEG")
+        return out.getvalue()
+
+    def upload(self, name, data):
+        return SimpleUploadedFile(name, data, content_type="image/jpeg")
+
+    def post_image(self, data):
+        return self.client.post(
+            reverse("create-progress-image"), {"category": "Arms", "image": self.upload("a.jpg", data)},
+            format="multipart",
+        )
+
+    def test_duplicate_is_never_sent(self):
+        data = self.jpeg("red")
+        first = self.post_image(data)
+        self.assertEqual(first.status_code, 201)
+        key = ProgressImage.objects.get().image.name
+        self.assertEqual([call for call, _ in self.s3.calls], ["create", "part", "complete"])
+        self.assertEqual(decrypt_bytes(self.s3.objects[key], self.user), data)
+
+        self.s3.calls.clear()
+        second = self.post_image(data)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()["id"], first.json()["id"])
+        # Smaller than a part: held until the duplicate check, then dropped without a request
+        self.assertEqual(self.s3.calls, [])
+        self.storage_delete.assert_not_called()
+        self.assertEqual(ProgressImage.objects.count(), 1)
+
+    def test_bad_category_aborts_the_open_upload(self):
+        response = self.client.post(
+            reverse("create-progress-image"), {"category": "Nope", "image": self.upload("a.jpg", self.jpeg("red"))},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.s3.objects, {})
+        self.assertEqual(self.s3.parts, {})
+        self.storage_delete.assert_not_called()
+
+    @override_settings(S3_UPLOAD_PART_SIZE=256, ENCRYPTION_CHUNK_SIZE=CHUNK)
+    def test_unused_image_parts_are_aborted(self):
+        first, second = (self.jpeg(color) for color in ("red", "blue"))
+        self.assertGreater(min(len(first), len(second)), 256)
+        response = self.client.post(
+            reverse("create-progress-image"),
+            {"category": "Arms", "image": [self.upload("a.jpg", first), self.upload("b.jpg", second)]},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201)
+        key = ProgressImage.objects.get().image.name
+        self.assertEqual(decrypt_bytes(self.s3.objects[key], self.user), second)
+        self.assertEqual([call for call, _ in self.s3.calls].count("abort"), 1)
+        self.assertEqual(self.s3.parts, {})
+
+    def test_batch_duplicates_are_aborted_not_completed(self):
+        existing = self.jpeg("red")
+        self.post_image(existing)
+        self.s3.calls.clear()
+        new = self.jpeg("blue")
+
+        response = self.client.post(
+            reverse("create-progress-images-batch"),
+            {"category": "Arms", "images": [
+                self.upload("a.jpg", existing), self.upload("b.jpg", new), self.upload("c.jpg", new),
+            ]},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201)
+        results = response.json()["results"]
+        self.assertTrue(results[0]["duplicate"])
+        self.assertEqual(results[2]["duplicate_of"], 1)
+
+        completed = [key for call, key in self.s3.calls if call == "complete"]
+        aborted = [key for call, key in self.s3.calls if call == "abort"]
+        self.assertEqual(completed, [ProgressImage.objects.get(id=results[1]["id"]).image.name])
+        self.assertEqual(len(aborted), 2)
+        self.assertEqual(self.s3.parts, {})
+        self.storage_delete.assert_not_called()
+
+    def test_batch_registers_every_image(self):
+        response = self.client.post(
+            reverse("create-progress-images-batch"),
+            {"category": "Arms", "images": [self.upload("a.jpg", self.jpeg("red")), self.upload("b.jpg", self.jpeg("blue"))]},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201)
+        images = ProgressImage.objects.all()
+        self.assertEqual(len(images), 2)
+        self.assertEqual(
+            set(MediaObject.objects.values_list("key", "user_id", "kind", "progress_image_id")),
+            {(img.image.name, self.user.id, MediaObject.KIND_IMAGE, img.id) for img in images},
+        )
+
+
+class FailingPool:
+    """
+    Stands in for a ProcessPoolExecutor whose submitted work raises `exc`.
+    """
+
+    def __init__(self, exc):
+        self.exc = exc
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(self.exc)
+        return future
+
+
+@override_settings(DERIVATIVE_JOB_MAX_ATTEMPTS=2)
+class DerivativeWorkerTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(username="worker", email="worker@example.com")
+        self.image = ProgressImage.objects.create(
+            user=user, category=Category.objects.create(name="Legs"), image="progress_images/w.jpg"
+        )
+        self.command = run_derivative_worker.Command(stdout=io.StringIO(), stderr=io.StringIO())
+
+    def status(self):
+        self.image.refresh_from_db()
+        return self.image.derivatives_status
+
+    def test_image_deleted_after_claim_is_skipped(self):
+        claim_next_derivative_image()
+        ProgressImage.objects.filter(id=self.image.id).delete()
+        self.assertEqual(run_derivative_worker.process_image(self.image.id), (self.image.id, None))
+
+    def test_requeue_until_attempts_are_used_up(self):
+        claim_next_derivative_image()
+        requeue_derivative_image(self.image.id)
+        self.assertEqual(self.status(), ProgressImage.DERIVATIVES_PENDING)
+        self.assertEqual(claim_next_derivative_image().id, self.image.id)
+        with self.assertLogs("api.utils.jobs", "ERROR"):
+            requeue_derivative_image(self.image.id)
+        self.assertEqual(self.status(), ProgressImage.DERIVATIVES_FAILED)
+
+    def test_broken_pool_requeues_and_returns(self):
+        self.command.feed_pool(FailingPool(BrokenProcessPool()), workers=2, poll_interval=0)
+        self.assertEqual(self.status(), ProgressImage.DERIVATIVES_PENDING)
+
+    def test_failed_future_does_not_stop_the_loop(self):
+        class Stop(Exception):
+            pass
+
+        with mock.patch.object(run_derivative_worker.time, "sleep", side_effect=Stop), \
+                mock.patch.object(run_derivative_worker.logger, "exception") as logged, \
+                self.assertLogs("api.utils.jobs", "ERROR"):
+            with self.assertRaises(Stop):
+                self.command.feed_pool(FailingPool(RuntimeError("db gone")), workers=1, poll_interval=0)
+        # Requeued, claimed and failed again until out of attempts, and the loop went on polling
+        self.assertEqual(logged.call_count, 2)
+        self.assertEqual(self.status(), ProgressImage.DERIVATIVES_FAILED)
+
+
+@override_settings(RENDER_JOB_STALE_AFTER=600, RENDER_JOB_MAX_ATTEMPTS=2)
+class RenderQueueTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="queue", email="queue@example.com")
+        category = Category.objects.create(name="Chest")
+        self.jobs = [VideoRenderJob.objects.create(user=self.user, category=category) for _ in range(2)]
+        # Both were admitted
+        RenderQuota.objects.create(user=self.user, in_flight=2, week_count=2)
+
+    def quota(self):
+        quota = RenderQuota.objects.get(user=self.user)
+        return quota.in_flight, quota.week_count
+
+    def make_stale(self, job):
+        VideoRenderJob.objects.filter(id=job.id).update(started_at=now() - timedelta(seconds=601))
+
+    def test_claims_oldest_once(self):
+        first = claim_next_render_job()
+        self.assertEqual(first.id, self.jobs[0].id)
+        self.assertEqual((first.status, first.attempts), (VideoRenderJob.STATUS_RUNNING, 1))
+        self.assertEqual(claim_next_render_job().id, self.jobs[1].id)
+        self.assertIsNone(claim_next_render_job())
+
+    def test_stale_job_is_reclaimed_until_attempts_are_used_up(self):
+        VideoRenderJob.objects.filter(id=self.jobs[1].id).delete()
+        job = claim_next_render_job()
+        self.assertIsNone(claim_next_render_job())
+
+        self.make_stale(job)
+        self.assertEqual(claim_next_render_job().attempts, 2)
+
+        self.make_stale(job)
+        with self.assertLogs("api.utils.jobs", "ERROR"):
+            self.assertIsNone(claim_next_render_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, VideoRenderJob.STATUS_FAILED)
+        self.assertEqual(self.quota(), (1, 1))
+
+    def test_unexpected_error_requeues_then_fails(self):
+        with mock.patch.object(jobs, "render_progress_video", side_effect=RuntimeError("ffmpeg died")), \
+                self.assertLogs("api.utils.jobs", "ERROR"):
+            job = run_render_job(claim_next_render_job())
+            self.assertEqual(job.status, VideoRenderJob.STATUS_QUEUED)
+            self.assertEqual(self.quota(), (2, 2))
+
+            # Still the oldest, so it is picked up again first
+            job = run_render_job(claim_next_render_job())
+            self.assertEqual((job.id, job.attempts), (self.jobs[0].id, 2))
+            self.assertEqual(job.status, VideoRenderJob.STATUS_FAILED)
+        self.assertEqual(self.quota(), (1, 1))
+        self.assertEqual(claim_next_render_job().id, self.jobs[1].id)
+
+    def test_render_error_fails_at_once(self):
+        with mock.patch.object(jobs, "render_progress_video", side_effect=RenderError("No images found.")):
+            job = run_render_job(claim_next_render_job())
+        self.assertEqual((job.status, job.error), (VideoRenderJob.STATUS_FAILED, "No images found."))
+        self.assertEqual(self.quota(), (1, 1))
+
+    def test_done_releases_without_refund(self):
+        with mock.patch.object(jobs, "render_progress_video", return_value=(None, {"count": 1})):
+            job = run_render_job(claim_next_render_job())
+        self.assertEqual((job.status, job.result), (VideoRenderJob.STATUS_DONE, {"count": 1}))
+        self.assertEqual(self.quota(), (1, 2))
+
+
+def read_video_colors(path):
+    """
+    The top-left pixel of every decoded frame of a video.
+    """
+    frames = imageio_ffmpeg.read_frames(path)
+    frames.send(None)
+    return [tuple(frame[:3]) for frame in frames]
+
+
+@override_settings(
+    ENCRYPTION_MASTER_KEY=base64.urlsafe_b64encode(b"m" * 32).decode(),
+    RENDER_PREFETCH_WORKERS=1,
+    RENDER_MAX_SEGMENTS=3,
+)
+class SegmentCacheTests(TestCase):
+    FPS = 2.5
+    SIZE = (64, 48)
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="segments", email="segments@example.com")
+        key_cache.discard(("keyring", self.user.id))
+        self.category = Category.objects.create(name="Shoulders")
+        self.storage = InMemoryStorage()
+        for model, field in ((ProgressImage, "image"), (VideoSegment, "file")):
+            patcher = mock.patch.object(model._meta.get_field(field), "storage", self.storage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.images = [self.add_image(i) for i in range(6)]
+
+    def add_image(self, i):
+        out = io.BytesIO()
+        Image.new("RGB", self.SIZE, (i * 40, 255 - i * 40, 0)).save(out, "JPEG", quality=95)
+        name = self.storage.save(f"progress_images/{i}.jpg", ContentFile(encrypt_bytes(out.getvalue(), self.user)))
+        return ProgressImage.objects.create(
+            user=self.user, category=self.category, image=name, date=now() + timedelta(minutes=i)
+        )
+
+    def render(self, frames, name):
+        out_path = os.path.join(self.tmp, name)
+        with mock.patch("api.utils.video.encode_frames", wraps=encode_frames) as encoded:
+            encode_timeline(frames, self.user, self.category, {"fps": self.FPS}, self.FPS, self.SIZE, out_path)
+        return out_path, encoded
+
+    def encode_starts(self, encoded):
+        return [call.kwargs.get("start", 0) for call in encoded.call_args_list]
+
+    def assertSameVideo(self, first, second):
+        a, b = read_video_colors(first), read_video_colors(second)
+        self.assertEqual(len(a), len(b))
+        for x, y in zip(a, b):
+            self.assertTrue(all(abs(int(p) - int(q)) < 12 for p, q in zip(x, y)), (x, y))
+
+    def full_render(self, frames, name):
+        out_path = os.path.join(self.tmp, name)
+        encode_frames(prefetch_frames(frames, self.user, self.SIZE), out_path, self.FPS, self.SIZE)
+        return out_path
+
+    def test_append_encodes_only_new_frames(self):
+        self.render(self.images[:4], "first.mp4")
+        path, encoded = self.render(self.images, "second.mp4")
+
+        # One new segment, starting at timeline index 4, holding the 2 new frames
+        self.assertEqual(self.encode_starts(encoded), [4])
+        chain = list(VideoSegment.objects.order_by("id"))
+        self.assertEqual([seg.frame_count for seg in chain], [4, 2])
+        self.assertEqual(chain[1].previous, chain[0])
+        self.assertEqual(chain[1].chain_key, segment_chain_keys(self.images, {"fps": self.FPS})[-1])
+        self.assertSameVideo(path, self.full_render(self.images, "full.mp4"))
+        self.assertEqual(len(set(read_video_colors(path))), 6)
+
+    def test_same_timeline_encodes_nothing(self):
+        self.render(self.images, "first.mp4")
+        path, encoded = self.render(self.images, "again.mp4")
+        encoded.assert_not_called()
+        self.assertSameVideo(path, self.full_render(self.images, "full.mp4"))
+
+    def test_deleting_a_middle_image_invalidates_the_chain(self):
+        self.render(self.images[:3], "first.mp4")
+        self.render(self.images, "second.mp4")
+        names = [seg.file.name for seg in VideoSegment.objects.all()]
+        self.assertEqual(len(names), 2)
+
+        self.images[1].delete()
+        self.assertFalse(VideoSegment.objects.exists())
+        for name in names:
+            self.assertFalse(self.storage.exists(name))
+
+        remaining = self.images[:1] + self.images[2:]
+        path, encoded = self.render(remaining, "after.mp4")
+        self.assertEqual(self.encode_starts(encoded), [0])
+        self.assertSameVideo(path, self.full_render(remaining, "full.mp4"))
+
+    def test_long_chain_is_compacted_into_one_segment(self):
+        for count in (2, 3, 4):
+            self.render(self.images[:count], f"{count}.mp4")
+        old = [seg.file.name for seg in VideoSegment.objects.all()]
+        self.assertEqual(len(old), 3)
+
+        path, encoded = self.render(self.images, "compacted.mp4")
+        self.assertEqual(self.encode_starts(encoded), [0])
+        segment = VideoSegment.objects.get()
+        self.assertEqual((segment.frame_count, segment.previous), (6, None))
+        for name in old:
+            self.assertFalse(self.storage.exists(name))
+        self.assertSameVideo(path, self.full_render(self.images, "full.mp4"))
+
+
+@override_settings(
+    ENCRYPTION_MASTER_KEY=base64.urlsafe_b64encode(b"m" * 32).decode(),
+    HLS_RENDITIONS=[
+        {"name": "low", "height": 480, "bitrate": 800_000},
+        {"name": "high", "height": 1080, "bitrate": 3_000_000},
+    ],
+)
+class HLSRenditionTests(TestCase):
+    def planned(self, src_size):
+        return [(rendition["name"], size) for rendition, size in hls.plan_renditions(src_size)]
+
+    def test_renditions_are_never_upscaled_or_repeated(self):
+        self.assertEqual(self.planned((320, 240)), [("low", (320, 240))])
+        self.assertEqual(self.planned((640, 481)), [("low", (638, 480))])
+        self.assertEqual(self.planned((1280, 720)), [("low", (852, 480)), ("high", (1280, 720))])
+        self.assertEqual(self.planned((1920, 1080)), [("low", (852, 480)), ("high", (1920, 1080))])
+        self.assertEqual(self.planned((3840, 2160)), [("low", (852, 480)), ("high", (1920, 1080))])
+
+    def test_small_source_gets_one_rendition(self):
+        user = CustomUser.objects.create_user(username="hls", email="hls@example.com")
+        key_cache.discard(("keyring", user.id))
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        mp4_path = os.path.join(tmp, "small.mp4")
+        encode_frames((Image.new("RGB", (320, 240), (i * 50, 0, 0)) for i in range(4)), mp4_path, 2)
+
+        with mock.patch.object(hls, "default_storage", InMemoryStorage()):
+            _, renditions = hls.build_hls(mp4_path, user, "progress_videos/hls")
+        self.assertEqual([(r["name"], r["resolution"]) for r in renditions], [("low", "320x240")])
+
+        video = mock.Mock(hls_renditions=renditions)
+        playlist = hls.master_playlist(video, lambda name: f"https://example.com/{name}.m3u8")
+        self.assertEqual(playlist.count("#EXT-X-STREAM-INF"), 1)
+        self.assertIn("RESOLUTION=320x240", playlist)
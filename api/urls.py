@@ -4,13 +4,21 @@ from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 from .views import (
     CreateProgressVideoView,
+    ProgressVideoJobView,
+    ProgressVideoHLSView,
     UploadVideoView,
     ProgressImageCreateView,
+    ProgressImageBatchCreateView,
+    UploadSessionCreateView,
+    UploadSessionView,
+    UploadSessionCompleteView,
     CategoryViewSet,
     UserCategoryProgressView,
+    GalleryManifestView,
     LogoutView,
     RegisterView,
     protected_media,
+    media_cache_stats,
     ProgressImageViewSet,
     MaxUnitViewSet,
     MaxCategoryViewSet,
@@ -33,20 +41,45 @@ urlpatterns = [
 
     path("progress/video/upload/", UploadVideoView.as_view(), name="progress-video-upload"),
     path("progress/video/create/", CreateProgressVideoView.as_view(), name="progress-video-create"),
+    path("progress/video/jobs/<int:job_id>/", ProgressVideoJobView.as_view(), name="progress-video-job"),
+    path("progress/video/<int:video_id>/hls/master.m3u8", ProgressVideoHLSView.as_view(), name="progress-video-hls"),
+    path(
+        "progress/video/<int:video_id>/hls/<str:rendition>.m3u8",
+        ProgressVideoHLSView.as_view(),
+        name="progress-video-hls-rendition"
+    ),
+    path("progress/video/<int:video_id>/hls/key", views.progress_video_hls_key, name="progress-video-hls-key"),
 
     path("auth/register/", RegisterView.as_view(), name="register"),
     path("auth/login/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("auth/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("auth/logout/", LogoutView.as_view(), name="auth_logout"),
 
+    # Before the <username>/<category_name> route, which would otherwise match them
+    path("progress/create/batch/", ProgressImageBatchCreateView.as_view(), name="create-progress-images-batch"),
+    path("progress/uploads/", UploadSessionCreateView.as_view(), name="upload-session-create"),
+    path("progress/uploads/<uuid:upload_id>/", UploadSessionView.as_view(), name="upload-session"),
+    path(
+        "progress/uploads/<uuid:upload_id>/complete/",
+        UploadSessionCompleteView.as_view(),
+        name="upload-session-complete"
+    ),
+
     path(
         "progress/<str:username>/<str:category_name>/",
         UserCategoryProgressView.as_view(),
         name="user-category-progress"
     ),
 
+    path(
+        "progress/<str:username>/<str:category_name>/manifest/",
+        GalleryManifestView.as_view(),
+        name="gallery-manifest"
+    ),
+
     path("progress/create/", ProgressImageCreateView.as_view(), name="create-progress-image"),
 
+    path("media/cache/stats/", media_cache_stats, name="media-cache-stats"),
     path("media/protected/<path:file_path>", protected_media, name="protected_media"),
 
     path("", include(router.urls)),
@@ -0,0 +1,96 @@
+import fcntl
+import os
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils.timezone import now
+
+from progress_tracking.models import RenderQuota, VideoRenderJob
+
+
+class RenderRejected(Exception):
+    """
+    A render request that must not be queued right now.
+    """
+
+    def __init__(self, detail, status=429, retry_after=None):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+        self.retry_after = retry_after
+
+
+def admit_render(user):
+    """
+    Reserves a render for user or raises RenderRejected.
+
+    Each check is a conditional UPDATE on the user's RenderQuota row, so
+    concurrent requests cannot both take the last slot. Call it in the same
+    transaction that creates the job, so the reservation never outlives a job
+    that was not created; release_render() frees it once the job finishes.
+    """
+    queued = VideoRenderJob.objects.filter(status=VideoRenderJob.STATUS_QUEUED)[:settings.RENDER_QUEUE_MAX].count()
+    if queued >= settings.RENDER_QUEUE_MAX:
+        raise RenderRejected(
+            "Too many videos are being rendered right now. Please try again shortly.",
+            retry_after=settings.RENDER_RETRY_AFTER,
+        )
+
+    RenderQuota.objects.get_or_create(user=user)
+    quota = RenderQuota.objects.filter(user=user)
+
+    if not user.is_premium:
+        # Start a new week once the current one is over
+        week = timedelta(days=7)
+        quota.filter(week_started_at__lte=now() - week).update(week_started_at=now(), week_count=0)
+
+        if not quota.filter(week_count__lt=settings.FREE_VIDEOS_PER_WEEK).update(week_count=F("week_count") + 1):
+            raise RenderRejected(
+                f"Free users can only create up to {settings.FREE_VIDEOS_PER_WEEK} videos per week.",
+                status=403,
+            )
+
+    if not quota.filter(in_flight__lt=settings.RENDER_MAX_IN_FLIGHT_PER_USER).update(in_flight=F("in_flight") + 1):
+        if not user.is_premium:
+            quota.update(week_count=F("week_count") - 1)
+        raise RenderRejected(
+            "You already have videos rendering. Please wait for them to finish.",
+            retry_after=settings.RENDER_RETRY_AFTER,
+        )
+
+
+def release_render(user_id, refund=False):
+    """
+    Frees the user's in-flight slot. With refund the render does not count
+    towards the weekly limit either (it failed).
+    """
+    quota = RenderQuota.objects.filter(user_id=user_id)
+    quota.filter(in_flight__gt=0).update(in_flight=F("in_flight") - 1)
+    if refund:
+        quota.filter(week_count__gt=0).update(week_count=F("week_count") - 1)
+
+
+@contextmanager
+def render_slot():
+    """
+    Host-wide cap on concurrent encodes, shared by every worker process on the
+    machine through lock files. Yields the slot number, or None when all
+    RENDER_MAX_CONCURRENT_PER_HOST slots are taken.
+    """
+    os.makedirs(settings.RENDER_SLOT_DIR, exist_ok=True)
+    for slot in range(settings.RENDER_MAX_CONCURRENT_PER_HOST):
+        fh = open(os.path.join(settings.RENDER_SLOT_DIR, f"slot{slot}.lock"), "w")
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fh.close()
+            continue
+        try:
+            yield slot
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+            fh.close()
+        return
+    yield None
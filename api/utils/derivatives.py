@@ -0,0 +1,85 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .encryption import encrypt_bytes, decrypt_bytes
+
+
+def make_derivative(source, max_size):
+    """
+    Returns JPEG bytes of source scaled to fit inside max_size (never upscaled).
+    """
+    frame = source.copy()
+    frame.thumbnail(max_size, Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    frame.save(buf, "JPEG", quality=settings.DERIVATIVE_JPEG_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+def recompress(source, source_format, original_size):
+    """
+    Returns source re-encoded as INGEST_FORMAT with its long side capped at
+    INGEST_MAX_DIMENSION, or None if it is already in that format and size or
+    the result wouldn't be smaller than the upload.
+    """
+    limit = settings.INGEST_MAX_DIMENSION
+    if source_format == settings.INGEST_FORMAT and max(source.size) <= limit:
+        return None
+
+    image = source.copy()
+    image.thumbnail((limit, limit), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    if settings.INGEST_FORMAT == "WEBP":
+        image.save(buf, "WEBP", quality=settings.INGEST_QUALITY, method=4)
+    else:
+        image.save(buf, "JPEG", quality=settings.INGEST_QUALITY, optimize=True, progressive=True)
+    data = buf.getvalue()
+    return data if len(data) < original_size else None
+
+
+def generate_derivatives(img):
+    """
+    Builds the thumbnail and video frame for a ProgressImage from its encrypted original.
+    Derivatives are encrypted with the owner's key like the original.
+
+    With INGEST_RECOMPRESS the original itself is replaced by a recompressed copy
+    (see recompress()); the upload is deleted once the row points at the new
+    file, or kept as `original` with INGEST_KEEP_ORIGINAL.
+    """
+    user = img.user
+    with img.image.open("rb") as fh:
+        data = decrypt_bytes(fh.read(), user)
+
+    opened = Image.open(io.BytesIO(data))
+    source = ImageOps.exif_transpose(opened).convert("RGB")
+
+    base = os.path.splitext(os.path.basename(img.image.name))[0]
+    derivatives = {
+        "thumbnail": (f"{base}_thumb.jpg", (settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE)),
+        "video_frame": (f"{base}_frame.jpg", settings.VIDEO_FRAME_SIZE),
+    }
+    for field_name, (name, max_size) in derivatives.items():
+        encrypted = encrypt_bytes(make_derivative(source, max_size), user)
+        getattr(img, field_name).save(name, ContentFile(encrypted), save=False)
+
+    update_fields = ["thumbnail", "video_frame", "derivatives_status"]
+    replaced = None
+    compact = recompress(source, opened.format, len(data)) if settings.INGEST_RECOMPRESS else None
+    if compact is not None:
+        replaced = img.image.name
+        ext = ".webp" if settings.INGEST_FORMAT == "WEBP" else ".jpg"
+        img.image.save(f"{base}{ext}", ContentFile(encrypt_bytes(compact, user)), save=False)
+        update_fields.append("image")
+        if settings.INGEST_KEEP_ORIGINAL:
+            img.original = replaced
+            update_fields.append("original")
+            replaced = None
+
+    img.derivatives_status = img.DERIVATIVES_READY
+    img.save(update_fields=update_fields)
+    if replaced:
+        img.image.storage.delete(replaced)
+    return img
@@ -1,15 +1,453 @@
-from cryptography.fernet import Fernet
+import base64
+import hmac
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError
+from django.db.models import Max
+
+# =========================
+# Segmented AEAD container
+# =========================
+# header: MAGIC (4) | version (1) | chunk size (4, big endian) | nonce prefix (7)
+#         version 2 adds: user key version (2) | data key wrapped by that user key (40)
+# body:   AES-256-GCM(chunk) + 16-byte tag per chunk; every chunk is `chunk size`
+#         bytes of plaintext except the last, which may be shorter (or empty).
+# Chunk nonces are prefix | chunk index (4) | last-chunk flag (1) and the first
+# 16 header bytes are authenticated with every chunk, so chunks can't be
+# reordered, dropped, truncated or moved between objects. The wrapped data key
+# is left out of the AAD so it can be re-wrapped without touching the body.
+#
+# Version 1 encrypts with a key derived from CustomUser.encryption_key;
+# version 2 (envelope) uses a random per-object data key. Anything not starting
+# with MAGIC is a legacy whole-file Fernet token.
+
+MAGIC = b"MLCS"
+VERSION = 2
+HEADER = struct.Struct(">4sBI7s")
+ENVELOPE = struct.Struct(">H40s")
+MAX_HEADER_SIZE = HEADER.size + ENVELOPE.size
+TAG_SIZE = 16
+
+
+class KeyCache:
+    """
+    Small thread-safe LRU for unwrapped keys, so batch work over a user's
+    objects does one DB read and unwrap instead of one per object.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+key_cache = KeyCache(settings.USER_KEY_CACHE_SIZE)
+
+
+def get_master_key():
+    """
+    Server key that wraps every user key (ENCRYPTION_MASTER_KEY).
+    """
+    if not settings.ENCRYPTION_MASTER_KEY:
+        raise ImproperlyConfigured("ENCRYPTION_MASTER_KEY must be set.")
+    try:
+        key = base64.urlsafe_b64decode(settings.ENCRYPTION_MASTER_KEY)
+    except ValueError:
+        key = b""
+    if len(key) != 32:
+        raise ImproperlyConfigured("ENCRYPTION_MASTER_KEY must be 32 bytes of urlsafe base64.")
+    return key
+
+
+def _load_keyring(user):
+    from user.models import UserKey
+
+    rows = list(UserKey.objects.filter(user_id=user.id).values_list("version", "wrapped_key"))
+    if not rows:
+        try:
+            UserKey.objects.create(user_id=user.id, version=1, wrapped_key=aes_key_wrap(get_master_key(), os.urandom(32)))
+        except IntegrityError:
+            pass  # created concurrently
+        rows = list(UserKey.objects.filter(user_id=user.id).values_list("version", "wrapped_key"))
+
+    master = get_master_key()
+    keys = {version: aes_key_unwrap(master, bytes(wrapped)) for version, wrapped in rows}
+    keyring = (time.monotonic(), max(keys), keys)
+    key_cache.put(("keyring", user.id), keyring)
+    return keyring
+
+
+def get_user_key(user, version=None):
+    """
+    Returns (version, key-encryption key) for user: the requested version, or
+    the current one for new objects. Unwrapped keys come from the in-process LRU;
+    the current version is re-checked every USER_KEY_CACHE_TTL seconds so
+    rotations made by other processes are picked up.
+    """
+    keyring = key_cache.get(("keyring", user.id))
+    if (
+        keyring is None
+        or (version is None and time.monotonic() - keyring[0] > settings.USER_KEY_CACHE_TTL)
+        or (version is not None and version not in keyring[2])
+    ):
+        keyring = _load_keyring(user)
+
+    loaded_at, current, keys = keyring
+    version = version or current
+    if version not in keys:
+        raise ValueError(f"Unknown key version {version} for user {user.id}")
+    return version, keys[version]
+
+
+def rotate_user_key(user):
+    """
+    Adds a new key version for user and makes it current. Existing objects keep
+    decrypting with their own version until rewrap_header() moves them over.
+    """
+    from user.models import UserKey
+
+    current = UserKey.objects.filter(user_id=user.id).aggregate(v=Max("version"))["v"] or 0
+    UserKey.objects.create(user_id=user.id, version=current + 1, wrapped_key=aes_key_wrap(get_master_key(), os.urandom(32)))
+    key_cache.discard(("keyring", user.id))
+    return current + 1
+
+
+def get_stream_key(user):
+    """
+    AES-256 key for version 1 containers, derived from the user's Fernet key.
+    """
+    if not user.encryption_key:
+        user.get_fernet()  # generates and saves a key for legacy users
+    cache_key = ("stream", user.id, user.encryption_key)
+    key = key_cache.get(cache_key)
+    if key is None:
+        secret = base64.urlsafe_b64decode(user.encryption_key)
+        key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"miloc stream v1").derive(secret)
+        key_cache.put(cache_key, key)
+    return key
+
+
+def content_hasher(user):
+    """
+    HMAC-SHA256 for the plaintext of user's uploads. Keyed per user so stored
+    hashes can't be matched against known files or across users.
+    """
+    cache_key = ("content", user.id)
+    key = key_cache.get(cache_key)
+    if key is None:
+        key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=f"miloc content {user.id}".encode()).derive(
+            get_master_key()
+        )
+        key_cache.put(cache_key, key)
+    return hmac.new(key, digestmod="sha256")
+
+
+def header_size(head):
+    return MAX_HEADER_SIZE if head[4] == 2 else HEADER.size
+
+
+def open_header(head, user):
+    """
+    Parses a container header. Returns (chunk size, nonce prefix, AESGCM for the body).
+    """
+    magic, version, chunk_size, prefix = HEADER.unpack(head[:HEADER.size])
+    if magic != MAGIC:
+        raise ValueError("Not a chunked object")
+    if version == 1:
+        return chunk_size, prefix, AESGCM(get_stream_key(user))
+    if version == 2:
+        key_version, wrapped = ENVELOPE.unpack(head[HEADER.size:MAX_HEADER_SIZE])
+        _, kek = get_user_key(user, key_version)
+        return chunk_size, prefix, AESGCM(aes_key_unwrap(kek, wrapped))
+    raise ValueError(f"Unsupported encryption format version {version}")
+
+
+def rewrap_header(head, user):
+    """
+    Re-wraps a version 2 header's data key under the user's current key version.
+    Only these header bytes change; the body is still valid under the same data
+    key, so rotation copies it through unchanged.
+    """
+    key_version, wrapped = ENVELOPE.unpack(head[HEADER.size:MAX_HEADER_SIZE])
+    _, old_kek = get_user_key(user, key_version)
+    new_version, new_kek = get_user_key(user)
+    dek = aes_key_unwrap(old_kek, wrapped)
+    return head[:HEADER.size] + ENVELOPE.pack(new_version, aes_key_wrap(new_kek, dek))
+
+
+def header_key_version(head):
+    """
+    User key version a version 2 header was wrapped with, or None for older formats.
+    """
+    if not is_chunked(head) or head[4] != 2:
+        return None
+    return ENVELOPE.unpack(head[HEADER.size:MAX_HEADER_SIZE])[0]
+
+
+def is_chunked(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+
+def chunk_nonce(prefix, index, last):
+    return prefix + struct.pack(">IB", index, 1 if last else 0)
+
+
+def encrypted_size(plain_size, chunk_size=None):
+    """
+    Size of the container for plain_size bytes of plaintext.
+    """
+    chunk_size = chunk_size or settings.ENCRYPTION_CHUNK_SIZE
+    chunks = max(1, -(-plain_size // chunk_size))
+    return MAX_HEADER_SIZE + plain_size + chunks * TAG_SIZE
+
+
+def read_full(fileobj, size):
+    """
+    read() that only returns short at EOF (network bodies may return less).
+    """
+    data = fileobj.read(size)
+    while data and len(data) < size:
+        more = fileobj.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+class StreamEncryptor:
+    """
+    Push-style encryption for data that arrives in pieces of any size (e.g. an
+    upload). `header` goes first, then whatever update() returns, then finalize().
+    Holds at most one chunk of plaintext.
+    """
+
+    def __init__(self, user, chunk_size=None):
+        self.chunk_size = chunk_size or settings.ENCRYPTION_CHUNK_SIZE
+        key_version, kek = get_user_key(user)
+        data_key = os.urandom(32)
+        self.aead = AESGCM(data_key)
+        self.prefix = os.urandom(7)
+        self.aad = HEADER.pack(MAGIC, VERSION, self.chunk_size, self.prefix)
+        self.header = self.aad + ENVELOPE.pack(key_version, aes_key_wrap(kek, data_key))
+        self.index = 0
+        self.pending = bytearray()
+
+    def _seal(self, chunk, last):
+        sealed = self.aead.encrypt(chunk_nonce(self.prefix, self.index, last), chunk, self.aad)
+        self.index += 1
+        return sealed
+
+    def update(self, data):
+        self.pending += data
+        sealed = []
+        # A full chunk is only sealed once more data follows it, so the last one can be flagged
+        while len(self.pending) > self.chunk_size:
+            sealed.append(self._seal(bytes(self.pending[:self.chunk_size]), last=False))
+            del self.pending[:self.chunk_size]
+        return b"".join(sealed)
+
+    def finalize(self):
+        sealed = self._seal(bytes(self.pending), last=True)
+        self.pending = bytearray()
+        return sealed
+
+
+def encrypt_stream(fileobj, user, chunk_size=None):
+    """
+    Encrypts a readable binary file object, yielding the container piece by piece.
+    Memory use is one chunk regardless of the input size.
+    """
+    encryptor = StreamEncryptor(user, chunk_size)
+    yield encryptor.header
+    while True:
+        data = fileobj.read(encryptor.chunk_size)
+        if not data:
+            break
+        sealed = encryptor.update(data)
+        if sealed:
+            yield sealed
+    yield encryptor.finalize()
+
+
+def decrypt_stream(fileobj, user):
+    """
+    Decrypts a container (or legacy Fernet token) from a readable binary file
+    object, yielding plaintext chunks as soon as each one is authenticated.
+    """
+    head = read_full(fileobj, HEADER.size)
+    if not is_chunked(head):
+        # Legacy Fernet: the whole token is needed before anything can be returned
+        yield user.get_fernet().decrypt(head + fileobj.read())
+        return
+
+    head += read_full(fileobj, header_size(head) - len(head))
+    chunk_size, prefix, aead = open_header(head, user)
+    aad = head[:HEADER.size]
+    sealed_size = chunk_size + TAG_SIZE
+    index = 0
+    sealed = read_full(fileobj, sealed_size)
+    while True:
+        following = read_full(fileobj, sealed_size) if len(sealed) == sealed_size else b""
+        last = not following
+        yield aead.decrypt(chunk_nonce(prefix, index, last), sealed, aad)
+        if last:
+            return
+        sealed = following
+        index += 1
+
+
+class ChunkLayout:
+    """
+    Where each plaintext byte of a chunked object lives in its ciphertext, from
+    the header and the object's total size. Lets callers fetch and decrypt only
+    the chunks covering a byte range.
+    """
+
+    def __init__(self, head, total_size):
+        if not is_chunked(head):
+            raise ValueError("Not a chunked object")
+        self.header_size = header_size(head)
+        self.head = head[:self.header_size]
+        magic, version, chunk_size, prefix = HEADER.unpack(head[:HEADER.size])
+        self.chunk_size = chunk_size
+        self.prefix = prefix
+        self.sealed_size = chunk_size + TAG_SIZE
+        self.total_size = total_size
+        body = total_size - self.header_size
+        self.chunk_count = max(1, -(-body // self.sealed_size))
+        self.plain_size = body - self.chunk_count * TAG_SIZE
+
+    def span(self, start, end):
+        """
+        Ciphertext (offset, length) of the chunks holding plaintext bytes start..end (inclusive).
+        """
+        first = start // self.chunk_size
+        last = end // self.chunk_size
+        offset = self.header_size + first * self.sealed_size
+        length = min((last - first + 1) * self.sealed_size, self.total_size - offset)
+        return offset, length
+
+    def decrypt_span(self, sealed, start, end, user):
+        """
+        Decrypts the bytes fetched for span(start, end) and returns plaintext start..end.
+        """
+        _, _, aead = open_header(self.head, user)
+        aad = self.head[:HEADER.size]
+        first = start // self.chunk_size
+        plain = []
+        for i in range(0, len(sealed), self.sealed_size):
+            index = first + i // self.sealed_size
+            last = index == self.chunk_count - 1
+            plain.append(aead.decrypt(chunk_nonce(self.prefix, index, last), sealed[i:i + self.sealed_size], aad))
+        skip = start - first * self.chunk_size
+        return b"".join(plain)[skip:skip + end - start + 1]
+
+
+class _BytesReader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def read(self, size=-1):
+        end = len(self.data) if size < 0 else self.pos + size
+        chunk = bytes(self.data[self.pos:end])
+        self.pos += len(chunk)
+        return chunk
+
+
+class IterReader:
+    """
+    Read-only file object over an iterator of byte chunks, so a stream can be
+    handed to anything expecting a file (e.g. an upload) without buffering it.
+    """
+
+    closed = False
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def seekable(self):
+        return False
 
-def get_user_key(user):
-    # IMPORTANT: this must be deterministic per user
-    # Example only — use your real logic
-    return settings.SECRET_KEY[:32].encode()
 
 def encrypt_bytes(data: bytes, user) -> bytes:
-    f = Fernet(Fernet.generate_key())
-    return f.encrypt(data)
+    return b"".join(encrypt_stream(_BytesReader(data), user))
+
 
 def decrypt_bytes(data: bytes, user) -> bytes:
-    f = Fernet(Fernet.generate_key())
-    return f.decrypt(data)
+    return b"".join(decrypt_stream(_BytesReader(data), user))
+
+
+def _rewrite(out_path, chunks):
+    # Write next to the destination and swap, so in-place rewrites never read a half-written file
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in chunks:
+                out.write(chunk)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def encrypt_file(path, user):
+    """
+    Encrypts a local file in place.
+    """
+    with open(path, "rb") as fh:
+        _rewrite(path, encrypt_stream(fh, user))
+
+
+def decrypt_file(path, user, out_path=None):
+    """
+    Decrypts a local file into out_path (or in place) and returns the output path.
+    """
+    out_path = out_path or path
+    with open(path, "rb") as fh:
+        _rewrite(out_path, decrypt_stream(fh, user))
+    return out_path
@@ -0,0 +1,151 @@
+import base64
+import os
+import shutil
+import subprocess
+import tempfile
+
+import imageio_ffmpeg
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from .encryption import encrypt_bytes, decrypt_bytes
+from .wasabi import generate_signed_url
+
+# Placeholder written into media playlists; swapped for the key endpoint when served
+KEY_URI_PLACEHOLDER = "key.bin"
+
+
+def video_size(path):
+    reader = imageio_ffmpeg.read_frames(path)
+    try:
+        return next(reader)["size"]
+    finally:
+        reader.close()
+
+
+def rendition_size(src_size, max_height):
+    src_w, src_h = src_size
+    h = min(max_height, src_h) // 2 * 2
+    w = max(2, round(src_w * h / src_h) // 2 * 2)
+    return w, h
+
+
+def plan_renditions(src_size):
+    """
+    (rendition, (w, h)) for each of settings.HLS_RENDITIONS worth encoding for
+    a source of src_size, lowest first. Renditions are never upscaled, so all
+    those at or above the source height would come out the same; only the
+    first of them is kept, at the source size. There is always at least one.
+    """
+    planned = []
+    for rendition in sorted(settings.HLS_RENDITIONS, key=lambda r: r["height"]):
+        size = rendition_size(src_size, rendition["height"])
+        if planned and size == planned[-1][1]:
+            break
+        planned.append((rendition, size))
+        if rendition["height"] >= src_size[1]:
+            break
+    return planned
+
+
+def build_hls(mp4_path, user, prefix):
+    """
+    Transcodes a rendered MP4 into the HLS renditions plan_renditions() picks
+    for its size and stores the segments under `prefix`.
+
+    Segments are AES-128 encrypted (standard HLS encryption) with a fresh key, so
+    they can be handed out as plain signed storage URLs while the key itself is
+    only served to the owner. Returns (encrypted key, renditions) for ProgressVideo.
+    """
+    key = os.urandom(16)
+    src_size = video_size(mp4_path)
+    seg_seconds = settings.HLS_SEGMENT_SECONDS
+
+    tmp_dir = tempfile.mkdtemp(prefix="hls_")
+    try:
+        key_path = os.path.join(tmp_dir, "key.bin")
+        with open(key_path, "wb") as fh:
+            fh.write(key)
+        key_info_path = os.path.join(tmp_dir, "key.info")
+        with open(key_info_path, "w") as fh:
+            fh.write(f"{KEY_URI_PLACEHOLDER}\n{key_path}\n")
+
+        renditions = []
+        for rendition, (w, h) in plan_renditions(src_size):
+            name = rendition["name"]
+            out_dir = os.path.join(tmp_dir, name)
+            os.makedirs(out_dir)
+
+            subprocess.run(
+                [
+                    imageio_ffmpeg.get_ffmpeg_exe(),
+                    "-y", "-loglevel", "error",
+                    "-i", mp4_path,
+                    "-vf", f"scale={w}:{h}",
+                    "-c:v", "libx264", "-pix_fmt", "yuv420p",
+                    "-b:v", str(rendition["bitrate"]),
+                    "-maxrate", str(rendition["bitrate"]),
+                    "-bufsize", str(rendition["bitrate"] * 2),
+                    # Keyframe at every segment boundary so both renditions switch cleanly
+                    "-force_key_frames", f"expr:gte(t,n_forced*{seg_seconds})",
+                    "-f", "hls",
+                    "-hls_time", str(seg_seconds),
+                    "-hls_playlist_type", "vod",
+                    "-hls_key_info_file", key_info_path,
+                    "-hls_segment_filename", os.path.join(out_dir, "seg_%04d.ts"),
+                    os.path.join(out_dir, "index.m3u8"),
+                ],
+                check=True,
+                capture_output=True,
+            )
+
+            lines = []
+            with open(os.path.join(out_dir, "index.m3u8")) as fh:
+                for line in fh.read().splitlines():
+                    if line and not line.startswith("#"):
+                        with open(os.path.join(out_dir, line), "rb") as seg:
+                            line = default_storage.save(f"{prefix}/{name}/{line}", File(seg))
+                    lines.append(line)
+
+            renditions.append({
+                "name": name,
+                "bandwidth": rendition["bitrate"],
+                "resolution": f"{w}x{h}",
+                "playlist": "\n".join(lines) + "\n",
+            })
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return base64.b64encode(encrypt_bytes(key, user)).decode(), renditions
+
+
+def hls_key(video):
+    return decrypt_bytes(base64.b64decode(video.hls_key), video.user)
+
+
+def master_playlist(video, rendition_url):
+    """
+    rendition_url(name) -> absolute URL of that rendition's media playlist.
+    """
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for rendition in video.hls_renditions:
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={rendition['bandwidth']},RESOLUTION={rendition['resolution']}"
+        )
+        lines.append(rendition_url(rendition["name"]))
+    return "\n".join(lines) + "\n"
+
+
+def media_playlist(rendition, key_url):
+    """
+    Stored media playlist with every segment swapped for a signed URL.
+    """
+    lines = []
+    for line in rendition["playlist"].splitlines():
+        if line.startswith("#EXT-X-KEY"):
+            line = line.replace(f'URI="{KEY_URI_PLACEHOLDER}"', f'URI="{key_url}"')
+        elif line and not line.startswith("#"):
+            line = generate_signed_url(line, expires=settings.HLS_URL_EXPIRES)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
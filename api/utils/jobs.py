@@ -0,0 +1,138 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from progress_tracking.models import VideoRenderJob, ProgressImage
+from .video import render_progress_video, RenderError
+from .derivatives import generate_derivatives
+from .admission import release_render
+
+logger = logging.getLogger(__name__)
+
+
+def claim_next_render_job():
+    """
+    Atomically takes the oldest queued job (or a running one whose worker died).
+    Returns None if there is nothing to do.
+
+    The claim is a conditional UPDATE, so any number of worker processes can poll
+    the same table without handing out a job twice. A job whose worker died on
+    each of its RENDER_JOB_MAX_ATTEMPTS attempts is failed instead of reclaimed.
+    """
+    stale_before = now() - timedelta(seconds=settings.RENDER_JOB_STALE_AFTER)
+    candidates = VideoRenderJob.objects.filter(
+        Q(status=VideoRenderJob.STATUS_QUEUED) |
+        Q(status=VideoRenderJob.STATUS_RUNNING, started_at__lt=stale_before)
+    ).order_by("created_at").values_list("id", "status", "started_at", "attempts", "user_id")[:10]
+
+    for job_id, status, started_at, attempts, user_id in candidates:
+        job = VideoRenderJob.objects.filter(id=job_id, status=status, started_at=started_at)
+        if status == VideoRenderJob.STATUS_RUNNING and attempts >= settings.RENDER_JOB_MAX_ATTEMPTS:
+            if job.update(status=VideoRenderJob.STATUS_FAILED, error="Video rendering failed.", finished_at=now()):
+                logger.error("Render job %s failed: worker died on every attempt", job_id)
+                release_render(user_id, refund=True)
+            continue
+
+        claimed = job.update(status=VideoRenderJob.STATUS_RUNNING, started_at=now())
+        if claimed:
+            job = VideoRenderJob.objects.select_related("user", "category").get(id=job_id)
+            job.attempts += 1
+            job.save(update_fields=["attempts"])
+            return job
+    return None
+
+
+def run_render_job(job):
+    """
+    Renders a claimed job and records the outcome on it.
+    """
+    try:
+        video, result = render_progress_video(job)
+    except RenderError as exc:
+        job.status = VideoRenderJob.STATUS_FAILED
+        job.error = str(exc)
+    except Exception:
+        logger.exception("Render job %s failed", job.id)
+        if job.attempts < settings.RENDER_JOB_MAX_ATTEMPTS:
+            # Leave it for the next poll
+            job.status = VideoRenderJob.STATUS_QUEUED
+        else:
+            job.status = VideoRenderJob.STATUS_FAILED
+        job.error = "Video rendering failed."
+    else:
+        job.status = VideoRenderJob.STATUS_DONE
+        job.video = video
+        job.result = result
+        job.error = ""
+
+    job.finished_at = now()
+    job.save(update_fields=["status", "video", "result", "error", "finished_at"])
+
+    if job.status != VideoRenderJob.STATUS_QUEUED:
+        release_render(job.user_id, refund=job.status == VideoRenderJob.STATUS_FAILED)
+    return job
+
+
+def claim_next_derivative_image():
+    """
+    Atomically takes the oldest ProgressImage still waiting for derivatives (or
+    one whose worker died while processing it), like claim_next_render_job().
+    """
+    stale_before = now() - timedelta(seconds=settings.DERIVATIVE_JOB_STALE_AFTER)
+    candidates = ProgressImage.objects.filter(
+        Q(derivatives_status=ProgressImage.DERIVATIVES_PENDING) |
+        Q(derivatives_status=ProgressImage.DERIVATIVES_PROCESSING, derivatives_started_at__lt=stale_before) |
+        # Left processing before claims were timestamped
+        Q(derivatives_status=ProgressImage.DERIVATIVES_PROCESSING, derivatives_started_at__isnull=True)
+    ).order_by("id").values_list("id", "derivatives_status", "derivatives_started_at", "derivatives_attempts")[:10]
+
+    for image_id, status, started_at, attempts in candidates:
+        image = ProgressImage.objects.filter(
+            id=image_id, derivatives_status=status, derivatives_started_at=started_at
+        )
+        if status == ProgressImage.DERIVATIVES_PROCESSING and attempts >= settings.DERIVATIVE_JOB_MAX_ATTEMPTS:
+            if image.update(derivatives_status=ProgressImage.DERIVATIVES_FAILED):
+                logger.error("Derivatives for progress image %s failed: worker died on every attempt", image_id)
+            continue
+
+        claimed = image.update(
+            derivatives_status=ProgressImage.DERIVATIVES_PROCESSING,
+            derivatives_started_at=now(),
+            derivatives_attempts=F("derivatives_attempts") + 1,
+        )
+        if claimed:
+            return ProgressImage.objects.select_related("user").get(id=image_id)
+    return None
+
+
+def requeue_derivative_image(image_id):
+    """
+    Hands back a claimed image whose worker died without recording an outcome:
+    pending again for the next claim, or failed once it has used up its
+    DERIVATIVE_JOB_MAX_ATTEMPTS.
+    """
+    image = ProgressImage.objects.filter(id=image_id, derivatives_status=ProgressImage.DERIVATIVES_PROCESSING)
+    if image.filter(derivatives_attempts__gte=settings.DERIVATIVE_JOB_MAX_ATTEMPTS).update(
+        derivatives_status=ProgressImage.DERIVATIVES_FAILED
+    ):
+        logger.error("Derivatives for progress image %s failed: worker died on every attempt", image_id)
+    else:
+        image.update(derivatives_status=ProgressImage.DERIVATIVES_PENDING, derivatives_started_at=None)
+
+
+def run_derivative_job(img):
+    """
+    Generates derivatives for a claimed image. On failure readers keep using the original.
+    """
+    try:
+        generate_derivatives(img)
+    except Exception:
+        logger.exception("Derivatives for progress image %s failed", img.id)
+        ProgressImage.objects.filter(id=img.id).update(
+            derivatives_status=ProgressImage.DERIVATIVES_FAILED
+        )
+        img.derivatives_status = ProgressImage.DERIVATIVES_FAILED
+    return img
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+# Objects bigger than this share of the budget are streamed but not kept
+MAX_ENTRY_SHARE = 10
+# How stale this process's view of the cache size may get before a rescan
+RESCAN_AFTER = 60
+
+
+class MediaCache:
+    """
+    Bounded on-disk cache of decrypted media, shared by every process on the host.
+
+    Entries are keyed by storage key + version and written atomically (temp file
+    then rename), so readers never see a partial file. Last use is tracked with
+    the file's mtime and the least recently used entries are evicted once the
+    directory grows past MEDIA_CACHE_MAX_BYTES.
+
+    The cache holds plaintext: MEDIA_CACHE_DIR must be on a private volume.
+    It is disabled unless MEDIA_CACHE_DIR is set.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._size = None
+        self._scanned_at = 0.0
+        self.counters = defaultdict(int)
+
+    @property
+    def enabled(self):
+        return bool(settings.MEDIA_CACHE_DIR)
+
+    def _path(self, key, version):
+        digest = hashlib.sha256(f"{key}\0{version}".encode()).hexdigest()
+        return os.path.join(settings.MEDIA_CACHE_DIR, digest[:2], digest)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def lookup(self, key, version=""):
+        """
+        Path of the cached plaintext, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key, version)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return path
+
+    def fill(self, key, version, chunks):
+        """
+        Passes plaintext chunks through while writing them to the cache. The entry
+        is only committed if the iterator is consumed to the end; a client that
+        disconnects early leaves nothing behind.
+        """
+        if not self.enabled:
+            yield from chunks
+            return
+
+        path = self._path(key, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        limit = settings.MEDIA_CACHE_MAX_BYTES // MAX_ENTRY_SHARE
+        written = 0
+        out = os.fdopen(fd, "wb")
+        try:
+            for chunk in chunks:
+                if out is not None:
+                    written += len(chunk)
+                    if written > limit:
+                        out.close()
+                        os.remove(tmp_path)
+                        out = None
+                    else:
+                        out.write(chunk)
+                yield chunk
+            if out is not None:
+                out.close()
+                os.replace(tmp_path, path)
+                out = None
+                self._count("writes")
+                self._added(written)
+        finally:
+            if out is not None:
+                out.close()
+                os.remove(tmp_path)
+
+    def _added(self, nbytes):
+        with self._lock:
+            if self._size is not None:
+                self._size += nbytes
+            stale = self._size is None or time.monotonic() - self._scanned_at > RESCAN_AFTER
+            over = not stale and self._size > settings.MEDIA_CACHE_MAX_BYTES
+        if stale or over:
+            self.evict()
+
+    def evict(self):
+        """
+        Rescans the cache directory and removes least recently used entries until
+        it is back under 90% of the budget.
+        """
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(settings.MEDIA_CACHE_DIR):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".tmp"):
+                    # Left behind by a killed process
+                    if now - st.st_mtime > 3600:
+                        self._remove(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if total > settings.MEDIA_CACHE_MAX_BYTES:
+            target = settings.MEDIA_CACHE_MAX_BYTES * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                if self._remove(path):
+                    self._count("evictions")
+                total -= size
+
+        with self._lock:
+            self._size = total
+            self._scanned_at = time.monotonic()
+
+    def discard(self, key, version=""):
+        if self.enabled:
+            self._remove(self._path(key, version))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.counters, "bytes": self._size}
+
+
+media_cache = MediaCache()
@@ -0,0 +1,200 @@
+import io
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+from progress_tracking.models import MediaObject, ProgressImage, UploadChunk, UploadSession
+from .encryption import IterReader, content_hasher, decrypt_bytes, decrypt_stream, encrypt_bytes, read_full
+from .uploads import (
+    EncryptedMultipartUpload, find_duplicate, finish_upload, looks_like_image, new_key, store_encrypted,
+    writes_to_bucket,
+)
+from .wasabi import get_s3_client, open_object, upload_object
+
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class UploadError(Exception):
+    """
+    A chunk or completion request that can't be accepted. The message is returned to the client.
+    """
+
+    def __init__(self, detail, status=400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+
+
+def chunk_key(session, index):
+    return f"uploads/{session.user_id}/{session.id}/{index:06d}"
+
+
+def chunk_length(session, index):
+    return min(session.chunk_size, session.size - index * session.chunk_size)
+
+
+def parse_chunk_range(session, header):
+    """
+    Chunk index for a `Content-Range: bytes start-end/total` header. Chunks must
+    start on a chunk_size boundary and be exactly one chunk long.
+    """
+    match = CONTENT_RANGE.match(header or "")
+    if not match:
+        raise UploadError("Content-Range: bytes <start>-<end>/<total> is required.")
+    start, end, total = map(int, match.groups())
+    if total != session.size:
+        raise UploadError(f"Total size must be {session.size}.")
+    if start % session.chunk_size or start >= session.size:
+        raise UploadError(f"Chunks must start at a multiple of {session.chunk_size}.", status=416)
+    index = start // session.chunk_size
+    if end - start + 1 != chunk_length(session, index):
+        raise UploadError(f"Chunk at {start} must be {chunk_length(session, index)} bytes.", status=416)
+    return index
+
+
+def is_expired(session):
+    return session.created_at < now() - timedelta(seconds=settings.RESUMABLE_UPLOAD_EXPIRES)
+
+
+def check_open(session):
+    """
+    Raises UploadError unless the session still accepts chunks and completion.
+    """
+    if session.assembling:
+        raise UploadError("This upload is already being completed.", status=409)
+    if is_expired(session):
+        raise UploadError("This upload has expired.", status=410)
+
+
+def store_chunk(session, index, stream):
+    """
+    Encrypts and stores one chunk read from `stream`. Re-sending a chunk replaces it.
+    """
+    check_open(session)
+    length = chunk_length(session, index)
+    data = read_full(stream, length)
+    if len(data) != length:
+        raise UploadError(f"Expected {length} bytes, got {len(data)}.")
+
+    key = chunk_key(session, index)
+    upload_object(key, io.BytesIO(encrypt_bytes(data, session.user)))
+    UploadChunk.objects.update_or_create(session=session, index=index, defaults={"key": key})
+
+
+def missing_chunks(session):
+    received = set(session.chunks.values_list("index", flat=True))
+    return [i for i in range(session.chunk_count) if i not in received]
+
+
+def session_status(session):
+    missing = missing_chunks(session)
+    missing_bytes = sum(chunk_length(session, i) for i in missing)
+    return {
+        "upload_id": str(session.id),
+        "size": session.size,
+        "chunk_size": session.chunk_size,
+        "received_bytes": session.size - missing_bytes,
+        "missing": [
+            {"offset": i * session.chunk_size, "length": chunk_length(session, i)}
+            for i in missing
+        ],
+    }
+
+
+def assemble(session):
+    """
+    Streams the stored chunks in order through decryption into one encrypted
+    object and creates the ProgressImage for it. The session is claimed with a
+    conditional UPDATE so a repeated complete request can't assemble it twice.
+
+    Returns (image, created). If the user already has an image with the same
+    content nothing new is kept and that image is returned.
+    """
+    check_open(session)
+    claimed = UploadSession.objects.filter(id=session.id, assembling=False).update(
+        assembling=True, assembling_since=now()
+    )
+    if not claimed:
+        raise UploadError("This upload is already being completed.", status=409)
+
+    try:
+        chunks = list(session.chunks.order_by("index"))
+        if [c.index for c in chunks] != list(range(session.chunk_count)):
+            raise UploadError("Some chunks are missing.", status=409)
+
+        body = open_object(chunks[0].key)
+        head = decrypt_bytes(body.read(), session.user)
+        body.close()
+        if not looks_like_image(head[:64]):
+            raise UploadError("Only image files are allowed.")
+
+        field = ProgressImage._meta.get_field("image")
+        key = new_key(field, session.user, session.file_name)
+        hasher = content_hasher(session.user)
+
+        def plaintext():
+            yield head
+            for chunk in chunks[1:]:
+                yield from decrypt_stream(open_object(chunk.key), session.user)
+
+        def hashed():
+            for data in plaintext():
+                hasher.update(data)
+                yield data
+
+        if writes_to_bucket(field.storage):
+            upload = EncryptedMultipartUpload(key, session.user, session.content_type)
+            try:
+                for data in hashed():
+                    upload.write(data)
+                duplicate = find_duplicate(session.user, session.category, hasher.hexdigest())
+            except BaseException:
+                upload.abort()
+                raise
+            if duplicate:
+                upload.abort()
+            else:
+                size = finish_upload(upload)
+        else:
+            # Not the bucket: the content is only hashed once it has been written
+            size = store_encrypted(field, IterReader(hashed()), key, session.user, session.content_type)
+            duplicate = find_duplicate(session.user, session.category, hasher.hexdigest())
+            if duplicate:
+                field.storage.delete(key)
+
+        if not duplicate:
+            try:
+                with transaction.atomic():
+                    img = ProgressImage.objects.create(
+                        user=session.user,
+                        category=session.category,
+                        image=key,
+                        date=session.date or now(),
+                        is_public=False,
+                        content_hash=hasher.hexdigest(),
+                    )
+                    MediaObject.objects.filter(key=key).update(size=size)
+            except BaseException:
+                field.storage.delete(key)
+                raise
+    except BaseException:
+        UploadSession.objects.filter(id=session.id).update(assembling=False, assembling_since=None)
+        raise
+
+    discard_session(session)
+    if duplicate:
+        return duplicate, False
+    return img, True
+
+
+def discard_session(session):
+    """
+    Deletes a session's stored chunks and the session itself.
+    """
+    s3 = get_s3_client()
+    for key in session.chunks.values_list("key", flat=True):
+        s3.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+    session.delete()
@@ -0,0 +1,122 @@
+import base64
+import itertools
+import logging
+
+from django.conf import settings
+
+from progress_tracking.models import ProgressImage, ProgressVideo
+from .encryption import (
+    MAX_HEADER_SIZE,
+    IterReader,
+    decrypt_bytes,
+    decrypt_stream,
+    encrypt_bytes,
+    encrypt_stream,
+    get_user_key,
+    header_key_version,
+    read_full,
+    rewrap_header,
+)
+from .wasabi import open_object, read_object_head, upload_object
+
+logger = logging.getLogger(__name__)
+
+# Encrypted storage fields per model. ProgressVideo.hls_key lives in the row itself.
+MEDIA_MODELS = {
+    "progress_image": (ProgressImage, ["image", "thumbnail", "video_frame", "original"]),
+    "progress_video": (ProgressVideo, ["video"]),
+}
+
+SKIPPED = "skipped"
+REWRAPPED = "rewrapped"
+REENCRYPTED = "reencrypted"
+FAILED = "failed"
+
+
+def _body_chunks(body, size):
+    while True:
+        chunk = body.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _counted(chunks, counter):
+    for chunk in chunks:
+        counter[0] += len(chunk)
+        yield chunk
+
+
+def reencrypt_object(key, user, force=False):
+    """
+    Brings one stored object up to the current container format and user key
+    version. Returns (action, bytes written).
+
+    Objects already in the envelope format only get their data key re-wrapped
+    and the body is copied through untouched; older formats are decrypted and
+    re-encrypted chunk by chunk. Either way the object is streamed, never held
+    in memory, and replaced in a single upload.
+    """
+    head = read_object_head(key, MAX_HEADER_SIZE)
+    current, _ = get_user_key(user)
+    version = header_key_version(head)
+    if version == current and not force:
+        return SKIPPED, 0
+
+    body = open_object(key)
+    if version is not None:
+        read_full(body, MAX_HEADER_SIZE)
+        chunks = itertools.chain([rewrap_header(head, user)], _body_chunks(body, settings.ENCRYPTION_CHUNK_SIZE))
+        action = REWRAPPED
+    else:
+        chunks = encrypt_stream(IterReader(decrypt_stream(body, user)), user)
+        action = REENCRYPTED
+
+    written = [0]
+    upload_object(key, IterReader(_counted(chunks, written)))
+    return action, written[0]
+
+
+def reencrypt_hls_key(video, force=False):
+    if not video.hls_key:
+        return SKIPPED
+    current, _ = get_user_key(video.user)
+    sealed = base64.b64decode(video.hls_key)
+    if header_key_version(sealed) == current and not force:
+        return SKIPPED
+
+    hls_key = base64.b64encode(encrypt_bytes(decrypt_bytes(sealed, video.user), video.user)).decode()
+    # Conditional so a concurrent re-render isn't overwritten with the old key
+    ProgressVideo.objects.filter(id=video.id, hls_key=video.hls_key).update(hls_key=hls_key)
+    return REENCRYPTED
+
+
+def reencrypt_row(label, pk, force=False):
+    """
+    Re-encrypts every object referenced by one row. Failures are logged and
+    reported per object so one bad object doesn't stop a batch.
+    Returns a list of (action, bytes written).
+    """
+    model, fields = MEDIA_MODELS[label]
+    row = model.objects.select_related("user").filter(pk=pk).first()
+    if row is None:
+        return []
+
+    results = []
+    for field in fields:
+        name = getattr(row, field).name
+        if not name:
+            continue
+        try:
+            results.append(reencrypt_object(name, row.user, force))
+        except Exception:
+            logger.exception("Re-encrypting %s %s (%s) failed", label, pk, name)
+            results.append((FAILED, 0))
+
+    if label == "progress_video":
+        try:
+            results.append((reencrypt_hls_key(row, force), 0))
+        except Exception:
+            logger.exception("Re-encrypting HLS key of progress video %s failed", pk)
+            results.append((FAILED, 0))
+    return results
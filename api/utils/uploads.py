@@ -0,0 +1,395 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from PIL import Image
+from storages.backends.s3 import S3Storage
+
+from progress_tracking.models import ProgressImage
+from .encryption import IterReader, StreamEncryptor, content_hasher, encrypt_stream
+from .wasabi import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+# Uploads parts in the background so receiving the next part overlaps with sending the last
+upload_executor = ThreadPoolExecutor(max_workers=settings.S3_UPLOAD_THREADS, thread_name_prefix="s3-upload")
+# Finishes uploads (last part + complete) while later files of a batch are still arriving.
+# Separate from upload_executor, which these tasks wait on.
+complete_executor = ThreadPoolExecutor(max_workers=settings.S3_UPLOAD_THREADS, thread_name_prefix="s3-complete")
+
+
+class EncryptedMultipartUpload:
+    """
+    Encrypts data as it is written and sends it to `key` as an S3 multipart upload.
+
+    Parts are S3_UPLOAD_PART_SIZE bytes (S3 needs at least 5 MiB for all but the
+    last) and at most one is in flight, so memory per upload stays around two parts
+    whatever the file size. Data is encrypted a part at a time and the upload is
+    only created with its first part, so one aborted before then (a duplicate,
+    typically) has cost neither encryption nor a storage request.
+    """
+
+    def __init__(self, key, user, content_type=None):
+        self.key = key
+        self.s3 = get_s3_client()
+        self.encryptor = StreamEncryptor(user)
+        self.content_type = content_type
+        self.upload_id = None
+        self.plaintext = bytearray()
+        self.buffer = bytearray(self.encryptor.header)
+        self.parts = []
+        self.in_flight = None
+        self.size = 0
+        self.flushed = False
+
+    def write(self, data):
+        self.plaintext += data
+        if len(self.plaintext) >= settings.S3_UPLOAD_PART_SIZE:
+            self._encrypt()
+            if len(self.buffer) >= settings.S3_UPLOAD_PART_SIZE:
+                self._send_part()
+
+    def _encrypt(self):
+        self.buffer += self.encryptor.update(bytes(self.plaintext))
+        self.plaintext = bytearray()
+
+    def _send_part(self):
+        if self.upload_id is None:
+            extra = {"ContentType": self.content_type} if self.content_type else {}
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=self.key, **extra
+            )["UploadId"]
+        body = bytes(self.buffer)
+        self.buffer = bytearray()
+        self._wait()
+        number = len(self.parts) + 1
+        self.size += len(body)
+        self.in_flight = (number, upload_executor.submit(
+            self.s3.upload_part,
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=body,
+        ))
+
+    def _wait(self):
+        if self.in_flight:
+            number, future = self.in_flight
+            self.in_flight = None
+            self.parts.append({"PartNumber": number, "ETag": future.result()["ETag"]})
+
+    def flush(self):
+        """
+        Encrypts and sends the rest as the final part, leaving only the completion to close().
+        """
+        if self.flushed:
+            return
+        self._encrypt()
+        self.buffer += self.encryptor.finalize()
+        self._send_part()
+        self._wait()
+        self.flushed = True
+
+    def close(self):
+        """
+        Sends the final part and completes the upload. Returns the stored size.
+        """
+        self.flush()
+        self.s3.complete_multipart_upload(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+        return self.size
+
+    def abort(self):
+        try:
+            self._wait()
+        except Exception:
+            pass
+        if self.upload_id is None:
+            return
+        try:
+            self.s3.abort_multipart_upload(
+                Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=self.key, UploadId=self.upload_id
+            )
+        except Exception:
+            logger.exception("Aborting multipart upload of %s failed", self.key)
+
+
+def upload_encrypted_file(path, key, user, content_type=None):
+    """
+    Encrypts a local file straight into storage under `key`. Returns the stored size.
+    """
+    with open(path, "rb") as fh:
+        return upload_encrypted_fileobj(fh, key, user, content_type)
+
+
+def upload_encrypted_fileobj(fileobj, key, user, content_type=None):
+    upload = EncryptedMultipartUpload(key, user, content_type)
+    try:
+        while True:
+            data = fileobj.read(settings.ENCRYPTION_CHUNK_SIZE)
+            if not data:
+                break
+            upload.write(data)
+        return upload.close()
+    except BaseException:
+        upload.abort()
+        raise
+
+
+def writes_to_bucket(storage):
+    """
+    True if `storage` keeps files at their keys in AWS_STORAGE_BUCKET_NAME, i.e.
+    an object written there with EncryptedMultipartUpload is the field's file.
+    """
+    return (
+        isinstance(storage, S3Storage)
+        and storage.bucket_name == settings.AWS_STORAGE_BUCKET_NAME
+        and not storage.location
+    )
+
+
+def store_encrypted(storage_field, fileobj, key, user, content_type=None):
+    """
+    Encrypts a readable file object into storage_field's storage under `key`.
+    Streams a multipart upload when that storage is the bucket, otherwise goes
+    through storage.save(). Returns the stored size.
+    """
+    storage = storage_field.storage
+    if writes_to_bucket(storage):
+        return upload_encrypted_fileobj(fileobj, key, user, content_type)
+    # Keys from new_key() are random, so the storage keeps the name it was given
+    name = storage.save(key, File(IterReader(encrypt_stream(fileobj, user)), name=key))
+    return storage.size(name)
+
+
+def find_duplicate(user, category, content_hash):
+    """
+    The user's earliest image with this content in category, if any. The same
+    photo may be filed under more than one category.
+    """
+    return ProgressImage.objects.filter(
+        user=user, category=category, content_hash=content_hash
+    ).order_by("id").first()
+
+
+def looks_like_image(head):
+    """
+    True if any Pillow decoder accepts these leading bytes (the same test Image.open starts with).
+    """
+    Image.init()
+    for _, accept in Image.OPEN.values():
+        if accept and accept(head):
+            return True
+    return False
+
+
+class StoredUpload(UploadedFile):
+    """
+    An uploaded file that was encrypted and stored while the request was read.
+    `key` is the storage key to put on the model; there is no content to read.
+    `error` is set instead when the upload was refused, and `duplicate` (with
+    no key) when the user already has an image with the same content.
+
+    Uploads from EncryptingUploadHandler are still open multipart uploads
+    (`upload`): nothing exists at `key` until complete() once check_duplicate()
+    has cleared them.
+    """
+
+    def __init__(self, key, name, content_type, size, charset=None, error=None, pending=None,
+                 content_hash="", duplicate=None, upload=None):
+        super().__init__(file=None, name=name, content_type=content_type, size=size, charset=charset)
+        self.key = key
+        self.error = error
+        self.pending = pending
+        self.content_hash = content_hash
+        self.duplicate = duplicate
+        self.upload = upload
+
+    def wait(self):
+        """
+        Waits for work running in the background (sending the last part, or
+        completing the upload); on failure `error` is set and `key` cleared.
+        """
+        if self.pending is not None:
+            try:
+                size = self.pending.result()
+            except Exception:
+                logger.exception("Upload of %s failed", self.key)
+                if self.upload is not None:
+                    self.upload.abort()
+                    self.upload = None
+                self.error = "Upload failed."
+                self.key = None
+            else:
+                if size is not None:
+                    self.size = size
+            self.pending = None
+        return self
+
+    def complete(self):
+        """
+        Completes the open multipart upload in the background; wait() for it.
+        """
+        self.wait()
+        if self.upload is not None and not self.error:
+            self.pending = complete_executor.submit(finish_upload, self.upload)
+            self.upload = None
+        return self
+
+    def discard(self):
+        self.wait()
+        if self.upload is not None:
+            # Never completed, so nothing was stored
+            self.upload.abort()
+            self.upload = None
+        elif self.key:
+            ProgressImage._meta.get_field("image").storage.delete(self.key)
+
+    def check_duplicate(self, user, category):
+        """
+        Sets `duplicate` if the user already has this content in category. The
+        handler sees files before the category is known, so a duplicate found
+        here is aborted (or deleted, if already stored) and `key` cleared.
+        """
+        if self.key and self.duplicate is None:
+            self.duplicate = find_duplicate(user, category, self.content_hash)
+            if self.duplicate:
+                self.discard()
+                self.key = None
+        return self.duplicate
+
+
+def new_key(storage_field, user, file_name):
+    """
+    Storage key for a new upload of user's to storage_field, from the field's
+    upload_to (random, so it can't collide with an existing or concurrent upload).
+    """
+    return storage_field.generate_filename(storage_field.model(user=user), file_name)
+
+
+def finish_upload(upload):
+    try:
+        return upload.close()
+    except BaseException:
+        upload.abort()
+        raise
+
+
+def stage_file(uploaded_file, user, storage_field, category):
+    """
+    Encrypts and uploads an already received image file in the background.
+    Returns a StoredUpload to complete() and wait() on, the same as the handler's uploads.
+    Files the user already has in category are hashed but not uploaded again.
+    """
+    content_type = uploaded_file.content_type or ""
+    head = uploaded_file.read(64)
+    uploaded_file.seek(0)
+    if not content_type.startswith("image/") or not looks_like_image(head):
+        return StoredUpload(None, uploaded_file.name, content_type, 0, error="Only image files are allowed.")
+
+    hasher = content_hasher(user)
+    for chunk in uploaded_file.chunks():
+        hasher.update(chunk)
+    content_hash = hasher.hexdigest()
+    duplicate = find_duplicate(user, category, content_hash)
+    if duplicate:
+        return StoredUpload(None, uploaded_file.name, content_type, 0, content_hash=content_hash, duplicate=duplicate)
+
+    key = new_key(storage_field, user, uploaded_file.name)
+
+    def run():
+        uploaded_file.seek(0)
+        return store_encrypted(storage_field, uploaded_file, key, user, content_type)
+
+    return StoredUpload(
+        key, uploaded_file.name, content_type, None, pending=complete_executor.submit(run), content_hash=content_hash
+    )
+
+
+class EncryptingUploadHandler(FileUploadHandler):
+    """
+    Streams image uploads in `field_names` through encryption into storage as the
+    request body arrives, instead of buffering the plaintext and a ciphertext copy.
+    Other fields and non-image content types fall through to Django's handlers.
+    Only install it when writes_to_bucket(storage_field.storage).
+
+    The plaintext is hashed on the way through. Duplicates are per category,
+    which may arrive after the file, so each upload is left open: callers
+    check_duplicate() and then complete() (or discard()) the StoredUploads.
+    A file smaller than S3_UPLOAD_PART_SIZE is only buffered until then, so a
+    duplicate costs no encryption and no storage request.
+
+    With defer_complete the last part of each file is sent in the background
+    while the next file is read, so a large batch doesn't hold every file's
+    tail in memory. Its duplicates are still aborted rather than completed,
+    but the parts were already sent.
+    """
+
+    def __init__(self, request, user, storage_field, field_names=("image",), defer_complete=False):
+        super().__init__(request)
+        self.user = user
+        self.storage_field = storage_field
+        self.field_names = field_names
+        self.defer_complete = defer_complete
+        self.active = False
+        self.stored = []
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.active = field_name in self.field_names and (content_type or "").startswith("image/")
+        self.upload = None
+        self.error = None
+        self.key = None
+        self.hasher = content_hasher(self.user) if self.active else None
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if self.error:
+            return None
+
+        if self.upload is None:
+            if not looks_like_image(raw_data[:64]):
+                self.error = "Only image files are allowed."
+                return None
+            self.key = new_key(self.storage_field, self.user, self.file_name)
+            self.upload = EncryptedMultipartUpload(self.key, self.user, self.content_type)
+
+        self.hasher.update(raw_data)
+        try:
+            self.upload.write(raw_data)
+        except BaseException:
+            self.upload.abort()
+            raise
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        error = self.error or (None if self.upload else "Empty file.")
+        if self.upload is None or error:
+            return StoredUpload(None, self.file_name, self.content_type, 0, charset=self.charset, error=error)
+
+        pending = complete_executor.submit(self.upload.flush) if self.defer_complete else None
+        stored = StoredUpload(
+            self.key, self.file_name, self.content_type, None, charset=self.charset,
+            pending=pending, content_hash=self.hasher.hexdigest(), upload=self.upload,
+        )
+        self.upload = None
+        self.stored.append(stored)
+        return stored
+
+    def upload_interrupted(self):
+        # The view never runs, so nothing else would clean these up
+        if self.active and self.upload is not None:
+            self.upload.abort()
+        for stored in self.stored:
+            complete_executor.submit(stored.discard)
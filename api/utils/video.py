@@ -0,0 +1,511 @@
+import hashlib
+import io
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
+from django.core.files import File
+
+import imageio_ffmpeg
+from PIL import ExifTags, Image, ImageOps
+
+from progress_tracking.models import ProgressImage, ProgressVideo, VideoSegment
+from .encryption import encrypt_file, decrypt_file, decrypt_bytes
+from .hls import build_hls
+from .uploads import upload_encrypted_file, writes_to_bucket
+
+
+class RenderError(Exception):
+    """
+    Raised for render requests that can never succeed (no images, bad range, ...).
+    The message is shown to the user on the job status endpoint.
+    """
+
+
+class RenderStats:
+    """
+    Accumulates wall time per render stage across all threads of this process.
+    Stage times from prefetch threads overlap, so they can add up to more than
+    the render's wall time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.seconds = defaultdict(float)
+            self.calls = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.seconds[name] += elapsed
+                self.calls[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {"seconds": round(self.seconds[name], 4), "calls": self.calls[name]}
+                for name in self.seconds
+            }
+
+
+render_stats = RenderStats()
+
+
+def select_frames(user, category, params):
+    """
+    Resolves the ordered list of ProgressImages a render job covers.
+    """
+    order = (params.get("order") or "oldest").lower()
+    qs = ProgressImage.objects.filter(user=user, category=category)
+    qs = qs.order_by("-date" if order == "newest" else "date")
+    images = list(qs)
+    if not images:
+        raise RenderError("No images found in this category.")
+
+    start_index = int(params.get("start_index", 0))
+    end_index = int(params.get("end_index", -1))
+
+    n = len(images)
+    if end_index < 0 or end_index >= n:
+        end_index = n - 1
+    start_index = max(0, min(start_index, n - 1))
+    end_index = max(0, min(end_index, n - 1))
+    if start_index > end_index:
+        raise RenderError("start_index must be <= end_index")
+
+    return images[start_index:end_index + 1]
+
+
+def render_cache_key(frames, params):
+    """
+    Content address of a render: the exact ordered frame ids plus everything
+    that changes the encoded output.
+    """
+    payload = {
+        "images": [img.id for img in frames],
+        "fps": float(params.get("fps", 2.0)),
+        "out_fps": output_fps(float(params.get("fps", 2.0))),
+        "width": params.get("width"),
+        "height": params.get("height"),
+        "hls": bool(params.get("hls")),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def find_cached_video(user, render_key):
+    return ProgressVideo.objects.filter(user=user, render_key=render_key).order_by("-created_at").first()
+
+
+def render_result(frames, fps):
+    """
+    Summary returned to the client for a finished (or cached) render.
+    """
+    start_date = frames[0].date
+    end_date = frames[-1].date
+    return {
+        "count": len(frames),
+        "duration_s": round(len(frames) / fps, 2),
+        "fps": fps,
+        "start_date": start_date.strftime('%Y-%m-%d %H:%M:%S'),
+        "end_date": end_date.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def load_frame(img, user, size=None):
+    """
+    Decrypts a ProgressImage in memory and decodes it to an RGB PIL image.
+    Uses the 1080p video frame derivative when it has been generated.
+    With a target size the frame is decoded at reduced resolution and
+    returned already fitted to the canvas.
+    """
+    source = img.video_frame if img.derivatives_status == img.DERIVATIVES_READY else img.image
+    with render_stats.stage("fetch"):
+        with source.open("rb") as fh:
+            data = fh.read()
+    with render_stats.stage("decrypt"):
+        data = decrypt_bytes(data, user)
+    with render_stats.stage("decode"):
+        return decode_frame(data, size)
+
+
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+# Modes Image.reduce() accepts; palette, bilevel and 16-bit images are converted first
+REDUCIBLE_MODES = {"L", "LA", "RGB", "RGBA", "CMYK"}
+
+
+def decode_frame(data, size=None):
+    """
+    Decodes image bytes to an RGB frame, oriented per EXIF.
+
+    When size is given the decoder does as little work as possible: JPEGs use
+    draft mode (libjpeg DCT scaling to 1/2, 1/4 or 1/8) and other formats are
+    box-reduced by an integer factor, always staying at or above the target.
+    The final step is a single high-quality resample onto the letterboxed canvas.
+    """
+    frame = Image.open(io.BytesIO(data))
+
+    if size:
+        target = size
+        if frame.getexif().get(ExifTags.Base.Orientation) in TRANSPOSED_ORIENTATIONS:
+            target = (size[1], size[0])
+        # Fit scale, so the reduced image still covers the letterboxed area
+        scale = min(target[0] / frame.width, target[1] / frame.height)
+        needed = (max(1, int(frame.width * scale)), max(1, int(frame.height * scale)))
+
+        if frame.format == "JPEG":
+            frame.draft("RGB", needed)
+        else:
+            factor = min(frame.width // needed[0], frame.height // needed[1])
+            if factor >= 2:
+                if frame.mode not in REDUCIBLE_MODES:
+                    frame = frame.convert("RGBA" if "transparency" in frame.info else "RGB")
+                frame = frame.reduce(factor)
+
+    frame = ImageOps.exif_transpose(frame).convert("RGB")
+    if size:
+        frame = fit_frame(frame, size)
+    return frame
+
+
+def prefetch_frames(images, user, size=None, workers=None, depth=None):
+    """
+    Yields load_frame() for each image, in order, while up to `depth` frames
+    are fetched and decrypted ahead on a pool of `workers` threads.
+    Storage round-trips and decryption overlap with encoding, and memory stays
+    bounded to `depth` decoded frames.
+    """
+    workers = workers or settings.RENDER_PREFETCH_WORKERS
+    depth = max(depth or settings.RENDER_PREFETCH_DEPTH, workers)
+
+    if workers <= 1:
+        for img in images:
+            yield load_frame(img, user, size)
+        return
+
+    images = iter(images)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frame-prefetch") as pool:
+        def submit_next():
+            img = next(images, None)
+            if img is not None:
+                pending.append(pool.submit(load_frame, img, user, size))
+
+        try:
+            for _ in range(depth):
+                submit_next()
+            while pending:
+                frame = pending.popleft().result()
+                submit_next()
+                yield frame
+        finally:
+            # Encoder failed or generator was closed: drop work not started yet
+            for future in pending:
+                future.cancel()
+
+
+def fit_frame(frame, size):
+    """
+    Scales a frame to fit inside size, centered on a black canvas.
+    """
+    if frame.size == size:
+        return frame
+    frame = ImageOps.contain(frame, size, Image.Resampling.LANCZOS)
+    canvas = Image.new("RGB", size)
+    canvas.paste(frame, ((size[0] - frame.width) // 2, (size[1] - frame.height) // 2))
+    return canvas
+
+
+def even_size(width, height):
+    # yuv420p needs even dimensions
+    return max(2, int(width) // 2 * 2), max(2, int(height) // 2 * 2)
+
+
+def output_fps(fps):
+    # Never below fps, so every frame is sent at least once
+    return max(1, math.ceil(fps))
+
+
+def encode_frames(frames, out_path, fps, size=None, start=0):
+    """
+    Streams RGB frames into an ffmpeg libx264 encoder, one frame in memory at a time.
+    Each frame is shown for 1/fps seconds at an output rate of output_fps(fps).
+    The canvas is size if given, otherwise the first frame's size.
+    `start` is the timeline index of the first frame, so separately encoded
+    segments repeat frames exactly as one continuous encode would.
+    Returns (number of frames consumed, canvas size).
+    """
+    out_fps = output_fps(fps)
+    writer = None
+    count = start
+    try:
+        for frame in frames:
+            if writer is None:
+                size = even_size(*(size or frame.size))
+                writer = imageio_ffmpeg.write_frames(
+                    out_path,
+                    size,
+                    fps=out_fps,
+                    codec="libx264",
+                    quality=None,
+                    macro_block_size=2,
+                )
+                writer.send(None)  # start ffmpeg
+
+            with render_stats.stage("encode"):
+                data = fit_frame(frame, size).tobytes()
+                # Repeat the frame to cover [count / fps, (count + 1) / fps) of output time
+                repeats = round((count + 1) * out_fps / fps) - round(count * out_fps / fps)
+                for _ in range(repeats):
+                    writer.send(data)
+            count += 1
+    finally:
+        if writer is not None:
+            with render_stats.stage("encode"):
+                writer.close()
+    return count - start, size
+
+
+def segment_chain_keys(frames, params):
+    """
+    chain_key for every prefix of the timeline: keys[i] covers frames[:i + 1].
+    """
+    digest = hashlib.sha256(json.dumps({
+        "fps": float(params.get("fps", 2.0)),
+        "out_fps": output_fps(float(params.get("fps", 2.0))),
+        "width": params.get("width"),
+        "height": params.get("height"),
+    }, sort_keys=True).encode())
+    keys = []
+    for img in frames:
+        digest.update(f"{img.id},".encode())
+        keys.append(digest.copy().hexdigest())
+    return keys
+
+
+def find_segment_chain(user, keys):
+    """
+    Longest chain of stored segments that encodes a prefix of the timeline,
+    oldest segment first. Empty if nothing can be reused.
+    """
+    found = {
+        seg.chain_key: seg
+        for seg in VideoSegment.objects.filter(user=user, chain_key__in=keys)
+    }
+    for key in reversed(keys):
+        if key in found:
+            break
+    else:
+        return []
+
+    chain = []
+    segment = found[key]
+    while segment is not None:
+        chain.append(segment)
+        segment = segment.previous
+    chain.reverse()
+    return chain
+
+
+def encode_segment(frames, user, category, fps, size, start, previous, chain_key):
+    """
+    Encodes frames as a new encrypted VideoSegment appended after `previous`.
+    The segment is saved through the field's storage, so every worker can reuse it.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="segment_")
+    seg_path = os.path.join(tmp_dir, "segment.mp4")
+    try:
+        count, size = encode_frames(prefetch_frames(frames, user, size), seg_path, fps, size, start=start)
+        with render_stats.stage("upload"):
+            encrypt_file(seg_path, user)
+            segment = VideoSegment(
+                user=user,
+                category=category,
+                previous=previous,
+                chain_key=chain_key,
+                frame_count=count,
+                width=size[0],
+                height=size[1],
+            )
+            with open(seg_path, "rb") as fh:
+                segment.file.save(f"{user.id}/{uuid.uuid4().hex}.mp4", File(fh), save=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return segment
+
+
+def delete_segment_tree(root):
+    """
+    Deletes a segment, every segment chained after it and their stored files.
+    """
+    segments, level = [], [root]
+    while level:
+        segments += level
+        level = list(VideoSegment.objects.filter(previous__in=level))
+    for segment in segments:
+        segment.file.delete(save=False)
+    root.delete()  # cascades to the rest
+
+
+def concat_segments(segments, user, out_path):
+    """
+    Joins encoded segments with ffmpeg's concat demuxer. Streams are copied,
+    not re-encoded.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="segments_")
+    try:
+        list_path = os.path.join(tmp_dir, "segments.txt")
+        with open(list_path, "w") as fh:
+            for i, segment in enumerate(segments):
+                part = os.path.join(tmp_dir, f"{i:05d}.mp4")
+                with segment.file.open("rb") as src, open(part, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                decrypt_file(part, user)
+                fh.write(f"file '{part}'\n")
+
+        subprocess.run(
+            [
+                imageio_ffmpeg.get_ffmpeg_exe(),
+                "-y", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", list_path,
+                "-c", "copy", "-movflags", "+faststart",
+                out_path,
+            ],
+            check=True,
+            capture_output=True,
+        )
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def encode_timeline(frames, user, category, params, fps, size, out_path):
+    """
+    Encodes frames to out_path, reusing stored segments for any prefix of the
+    timeline that was rendered before and encoding only the frames after it.
+    """
+    keys = segment_chain_keys(frames, params)
+    chain = find_segment_chain(user, keys)
+    superseded = None
+    if len(chain) >= settings.RENDER_MAX_SEGMENTS:
+        # Compact long chains of small appends into one fresh segment
+        superseded = chain[0]
+        chain = []
+
+    done = sum(segment.frame_count for segment in chain)
+    if chain and size is None:
+        size = (chain[0].width, chain[0].height)
+
+    if done < len(frames):
+        chain.append(encode_segment(
+            frames[done:], user, category, fps, size,
+            start=done,
+            previous=chain[-1] if chain else None,
+            chain_key=keys[-1],
+        ))
+
+    with render_stats.stage("concat"):
+        concat_segments(chain, user, out_path)
+
+    if superseded is not None:
+        delete_segment_tree(superseded)
+
+
+def render_progress_video(job):
+    """
+    Renders the video described by a VideoRenderJob.
+    Returns (ProgressVideo, result dict).
+    """
+    user = job.user
+    params = job.params
+    fps = float(params.get("fps", 2.0))
+    width = params.get("width")
+    height = params.get("height")
+
+    if fps <= 0:
+        raise RenderError("fps must be > 0")
+
+    frames = select_frames(user, job.category, params)
+
+    render_key = render_cache_key(frames, params)
+    cached = find_cached_video(user, render_key)
+    if cached:
+        return cached, render_result(frames, fps)
+
+    start_date = frames[0].date
+    end_date = frames[-1].date
+
+    user_folder = os.path.join("progress_videos", str(user.id))
+    os.makedirs(user_folder, exist_ok=True)
+
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    out_name = f"{stamp}_{uuid.uuid4().hex[:8]}.mp4"
+    out_path = os.path.join(user_folder, out_name)
+
+    size = even_size(width, height) if width and height else None
+    try:
+        if settings.RENDER_SEGMENT_CACHE:
+            encode_timeline(frames, user, job.category, params, fps, size, out_path)
+        else:
+            encode_frames(prefetch_frames(frames, user, size), out_path, fps, size)
+    except Exception:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        raise
+
+    rel_path = out_path.replace("\\", "/")
+
+    hls_key, hls_renditions = "", []
+    if params.get("hls"):
+        with render_stats.stage("hls"):
+            try:
+                hls_key, hls_renditions = build_hls(out_path, user, os.path.splitext(rel_path)[0] + "_hls")
+            except Exception:
+                os.remove(out_path)
+                raise
+
+    with render_stats.stage("upload"):
+        if settings.STREAMING_UPLOADS and writes_to_bucket(ProgressVideo._meta.get_field("video").storage):
+            # Encrypt straight into the bucket; nothing encrypted is written locally
+            try:
+                upload_encrypted_file(out_path, rel_path, user, "video/mp4")
+            finally:
+                os.remove(out_path)
+        else:
+            encrypt_file(out_path, user)
+
+    progress_video = ProgressVideo.objects.create(
+        user=user,
+        category=job.category,
+        video=rel_path,
+        is_public=False,
+        fps=fps,
+        start_date=start_date,
+        end_date=end_date,
+        render_key=render_key,
+        hls_key=hls_key,
+        hls_renditions=hls_renditions
+    )
+    progress_video.source_images.set(frames)
+
+    return progress_video, render_result(frames, fps)
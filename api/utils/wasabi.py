@@ -1,40 +1,157 @@
+import itertools
+import os
+import threading
+import time
+
 import boto3
 from django.conf import settings
-import tempfile
-from .encryption import decrypt_file
+from .encryption import (
+    decrypt_stream, is_chunked, read_full, ChunkLayout, IterReader, KeyCache, MAX_HEADER_SIZE, TAG_SIZE,
+)
+
+# Longest lifetime S3 allows for a SigV4 presigned URL
+MAX_SIGNED_URL_EXPIRES = 7 * 24 * 3600
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+signed_urls = KeyCache(settings.SIGNED_URL_CACHE_SIZE)
+
 
 def get_s3_client():
-    return boto3.client(
-        "s3",
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-        region_name=settings.AWS_S3_REGION_NAME,
-    )
+    """
+    The process-wide S3 client. boto3 clients are thread-safe and pool their
+    connections (settings.AWS_S3_CLIENT_CONFIG), so one is shared by every
+    thread; a forked child builds its own rather than reuse the parent's sockets.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = boto3.client(
+                    "s3",
+                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                    endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+                    region_name=settings.AWS_S3_REGION_NAME,
+                    config=settings.AWS_S3_CLIENT_CONFIG,
+                )
+                _client_pid = os.getpid()
+    return _client
+
 
 def generate_signed_url(key, expires=300):
+    """
+    Presigned GET URL valid for at least `expires` seconds. URLs are signed for
+    twice that and reused from an in-process cache until only `expires` remain.
+    """
+    cached = signed_urls.get((key, expires))
+    if cached is not None and cached[1] - time.monotonic() >= expires:
+        return cached[0]
+
+    lifetime = min(expires * 2, MAX_SIGNED_URL_EXPIRES)
     s3 = get_s3_client()
-    return s3.generate_presigned_url(
+    url = s3.generate_presigned_url(
         "get_object",
         Params={
             "Bucket": settings.AWS_STORAGE_BUCKET_NAME,
             "Key": key,
         },
-        ExpiresIn=expires,
+        ExpiresIn=lifetime,
     )
+    signed_urls.put((key, expires), (url, time.monotonic() + lifetime))
+    return url
+
+def _read_chunks(body, size):
+    while True:
+        chunk = body.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def stream_decrypted(key, user):
+    """
+    Decrypts an object while it downloads, without touching disk.
+    Returns (plaintext size, iterator of plaintext chunks); the size is None
+    for legacy objects, which are only known once fully decrypted.
+
+    Every chunk is authenticated before it is yielded, so a tampered or
+    truncated object stops the iterator with an error instead of returning
+    bad bytes.
+    """
+    s3 = get_s3_client()
+    resp = s3.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+    body = resp["Body"]
+    head = read_full(body, MAX_HEADER_SIZE)
+    size = None
+    if is_chunked(head):
+        size = ChunkLayout(head, resp["ContentLength"]).plain_size
+
+    def chunks():
+        try:
+            sealed = itertools.chain([head], _read_chunks(body, settings.ENCRYPTION_CHUNK_SIZE + TAG_SIZE))
+            yield from decrypt_stream(IterReader(sealed), user)
+        finally:
+            body.close()
+
+    return size, chunks()
+
+
+def get_chunk_layout(key):
+    """
+    Reads just the header of an encrypted object (one ranged GET).
+    Returns None for legacy objects, which can only be decrypted whole.
+    """
+    s3 = get_s3_client()
+    resp = s3.get_object(
+        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+        Key=key,
+        Range=f"bytes=0-{MAX_HEADER_SIZE - 1}",
+    )
+    head = resp["Body"].read()
+    if not is_chunked(head):
+        return None
+    total_size = int(resp["ContentRange"].rsplit("/", 1)[1])
+    return ChunkLayout(head, total_size)
+
+
+def get_decrypted_range(key, layout, user, start, end):
+    """
+    Fetches only the ciphertext chunks covering plaintext bytes start..end and decrypts them.
+    """
+    offset, length = layout.span(start, end)
+    s3 = get_s3_client()
+    resp = s3.get_object(
+        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+        Key=key,
+        Range=f"bytes={offset}-{offset + length - 1}",
+    )
+    return layout.decrypt_span(resp["Body"].read(), start, end, user)
+
+
+
+def open_object(key):
+    """
+    Streaming body of an object; read() pulls from the network as it goes.
+    """
+    s3 = get_s3_client()
+    return s3.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)["Body"]
+
+
+def read_object_head(key, size):
+    s3 = get_s3_client()
+    resp = s3.get_object(
+        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+        Key=key,
+        Range=f"bytes=0-{size - 1}",
+    )
+    return resp["Body"].read()
+
 
-def get_decrypted_temp_file(key, user):
+def upload_object(key, fileobj):
     """
-    Downloads encrypted file from S3, decrypts it locally, and returns the temp file path.
-    Caller is responsible for deleting temp file.
+    Uploads a readable file object to key (multipart for large bodies), replacing any existing object.
     """
     s3 = get_s3_client()
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=key.split('.')[-1])
-    s3.download_file(settings.AWS_STORAGE_BUCKET_NAME, key, tmp.name)
-    decrypted_tmp = tempfile.NamedTemporaryFile(delete=False, suffix=key.split('.')[-1])
-    decrypt_file(tmp.name, user, decrypted_tmp.name)
-    tmp.close()
-    # remove the original encrypted temp
-    import os
-    os.remove(tmp.name)
-    return decrypted_tmp.name
+    s3.upload_fileobj(fileobj, settings.AWS_STORAGE_BUCKET_NAME, key)
@@ -0,0 +1,22 @@
+import django
+from django.db import connections
+
+# Connections inherited from the parent, kept referenced so garbage collection
+# never closes them in a child
+_inherited = []
+
+
+def init_worker():
+    """
+    ProcessPoolExecutor initializer for workers forked from a Django process.
+
+    The pool forks lazily on submit(), by which time the parent has usually
+    queried the database again, so a child starts with a copy of the parent's
+    open connection. Closing it would end the parent's session; the child
+    drops it instead and opens its own on first use.
+    """
+    django.setup()
+    for conn in connections.all(initialized_only=True):
+        if conn.connection is not None:
+            _inherited.append(conn.connection)
+            conn.connection = None
@@ -1,34 +1,46 @@
+import base64
+import hashlib
+import io
 import os
 import mimetypes
-import tempfile
-import uuid
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from rest_framework.decorators import action
 
-from django.http import Http404, FileResponse
+from django.http import Http404, FileResponse, HttpResponse, StreamingHttpResponse
 from django.conf import settings
+from django.db import transaction
 from django.shortcuts import get_object_or_404
-from django.utils.timezone import now
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date
+from django.utils.timezone import now, is_naive, make_aware
 from rest_framework import generics, permissions, viewsets, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.exceptions import ValidationError, PermissionDenied
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken, TokenError
-from moviepy import ImageClip, concatenate_videoclips
 
-from progress_tracking.models import ProgressImage, Category, ProgressVideo
+from progress_tracking.models import ProgressImage, Category, ProgressVideo, VideoRenderJob, MediaObject, UploadSession
 from .serializers import *
 from user.models import CustomUser
 from .base import CsrfExemptAPIView
-from .utils.encryption import encrypt_file, decrypt_file
+from .utils.encryption import encrypt_file, content_hasher, decrypt_bytes
 from django.urls import reverse
 
 from core.models import FeedbackMessage
 
-import boto3
-from .utils.wasabi import generate_signed_url, get_decrypted_temp_file
+from .utils.wasabi import get_s3_client, generate_signed_url, stream_decrypted, get_chunk_layout, get_decrypted_range
+from .utils.video import RenderError, select_frames, render_cache_key, find_cached_video, render_result
+from .utils.hls import master_playlist, media_playlist, hls_key
+from .utils.admission import admit_render, RenderRejected
+from .utils.media_cache import media_cache
+from .utils.uploads import EncryptingUploadHandler, StoredUpload, find_duplicate, stage_file, writes_to_bucket
+from .utils.resumable import (
+    UploadError, assemble, discard_session, parse_chunk_range, session_status, store_chunk,
+)
 
 
 from django.core.files.base import ContentFile
@@ -36,18 +48,6 @@ from .serializers import ProgressImageSerializer
 from .utils.encryption import encrypt_bytes
 
 
-# =========================
-# Wasabi S3 Client
-# =========================
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-    region_name=settings.AWS_S3_REGION_NAME,
-    endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-)
-
-
 # =========================
 # Feedback
 # =========================
@@ -72,87 +72,305 @@ def create_feedback(request):
 # =========================
 
 
+UNSATISFIABLE = "unsatisfiable"
+
+
+def parse_byte_range(header, size):
+    """
+    Parses a single-range `Range: bytes=...` header against a resource of `size` bytes.
+    Returns (start, end) inclusive, None to serve the whole resource (absent,
+    malformed, multi-range, or a last byte before the first), or UNSATISFIABLE
+    when the range starts beyond the resource. Every range, explicit ones
+    included, is capped at PROTECTED_MEDIA_MAX_RANGE bytes so a single request
+    never holds a whole video in memory; clients continue from the returned
+    Content-Range.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(0, size - int(last))
+            end = size - 1
+    except ValueError:
+        return None
+
+    if first and last and end < start:
+        # Invalid range-spec: ignore the header (RFC 9110 14.1.1)
+        return None
+    if start >= size:
+        return UNSATISFIABLE
+    return start, min(end, size - 1, start + settings.PROTECTED_MEDIA_MAX_RANGE - 1)
+
+
+def media_cache_version(media):
+    # Object keys are never reused for different content; the registry id guards against it anyway
+    return f"media:{media.id}" if media else ""
+
+
+def media_etag(media):
+    # Plaintext behind a registered key never changes (re-encryption keeps it), so key + row is a strong validator
+    digest = hashlib.sha256(f"{media.key}\0{media.id}".encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def add_media_cache_headers(response, etag, last_modified):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(int(last_modified.timestamp()))
+    # Decrypted bytes: the owner's device may keep them, shared caches may not
+    response["Cache-Control"] = f"private, max-age={settings.PROTECTED_MEDIA_MAX_AGE}"
+    return response
+
+
+def cached_media_response(path, range_header, content_type, file_name):
+    size = os.path.getsize(path)
+    byte_range = parse_byte_range(range_header, size)
+    if byte_range == UNSATISFIABLE:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+    if byte_range:
+        start, end = byte_range
+        with open(path, "rb") as fh:
+            fh.seek(start)
+            data = fh.read(end - start + 1)
+        response = HttpResponse(data, status=206, content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    else:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+    response["Accept-Ranges"] = "bytes"
+    response["Content-Disposition"] = f'inline; filename="{file_name}"'
+    return response
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def protected_media(request, file_path):
     """
     Returns signed URL if public, otherwise downloads, decrypts and serves file.
     """
-    progress_image = ProgressImage.objects.filter(image=file_path, user=request.user).first()
-    progress_video = ProgressVideo.objects.filter(video=file_path, user=request.user).first()
-
-    # Access control
-    if not progress_image and not progress_video:
+    # Access control: one probe of the unique key index
+    media = MediaObject.objects.filter(key=file_path, user=request.user).only(
+        "id", "key", "is_public", "created_at"
+    ).first()
+    if not media:
         allowed_prefix = os.path.join("progress_videos", str(request.user.id)) + os.sep
         if not file_path.startswith(allowed_prefix):
             raise Http404("You do not have permission to access this file.")
 
-    is_private = (
-        (progress_image and not progress_image.is_public) or
-        (progress_video and not progress_video.is_public)
-    )
-
-    if not is_private:
+    if not media or media.is_public:
         # Public → return signed URL
         url = generate_signed_url(file_path, expires=3600)
         return Response({"url": url})
 
-    # Private → download & decrypt temp file
-    temp_path = get_decrypted_temp_file(file_path, request.user)
+    # Private + client already has it → 304 before touching storage
+    etag = media_etag(media)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(media.created_at.timestamp()))
+    if not_modified is not None:
+        return add_media_cache_headers(not_modified, etag, media.created_at)
+
     file_name = os.path.basename(file_path)
     content_type, _ = mimetypes.guess_type(file_name)
     if not content_type:
         content_type = "application/octet-stream"
 
-    response = FileResponse(
-        open(temp_path, "rb"),
-        content_type=content_type,
-        as_attachment=False,
-    )
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if if_range and if_range not in (etag, http_date(int(media.created_at.timestamp()))):
+        # The client's partial copy is of something else: send the whole object
+        range_header = None
+
+    # Private + cached on this host → no storage round trip at all
+    version = media_cache_version(media)
+    cached_path = media_cache.lookup(file_path, version)
+    if cached_path:
+        response = cached_media_response(cached_path, range_header, content_type, file_name)
+        return add_media_cache_headers(response, etag, media.created_at)
+
+    # Private + Range → fetch and decrypt only the chunks covering the range
+    layout = get_chunk_layout(file_path) if range_header else None
+    if layout:
+        byte_range = parse_byte_range(range_header, layout.plain_size)
+        if byte_range == UNSATISFIABLE:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{layout.plain_size}"
+            return response
+        if byte_range:
+            start, end = byte_range
+            data = get_decrypted_range(file_path, layout, request.user, start, end)
+            response = HttpResponse(data, status=206, content_type=content_type)
+            response["Content-Range"] = f"bytes {start}-{end}/{layout.plain_size}"
+            response["Accept-Ranges"] = "bytes"
+            response["Content-Disposition"] = f'inline; filename="{file_name}"'
+            return add_media_cache_headers(response, etag, media.created_at)
+
+    # Private → decrypt while downloading and stream to the client
+    size, chunks = stream_decrypted(file_path, request.user)
+    chunks = media_cache.fill(file_path, version, chunks)
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
     response["Content-Disposition"] = f'inline; filename="{file_name}"'
-
-    # Delete temp file after response is closed
-    old_close = response.close
-    def close():
-        old_close()
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-    response.close = close
-
-    return response
+    response["Accept-Ranges"] = "bytes"
+    if size is not None:
+        response["Content-Length"] = str(size)
+    return add_media_cache_headers(response, etag, media.created_at)
 
 # =========================
 # User category progress
 # =========================
+def category_images(request, username, category_name):
+    """
+    The requesting user's images in a category, oldest first. Optional `since`
+    / `until` query parameters (ISO dates or datetimes) narrow the window.
+    """
+    if request.user.username != username:
+        raise PermissionDenied("You are not allowed to view another user's progress.")
+
+    category = get_object_or_404(Category, name__iexact=category_name)
+    images = ProgressImage.objects.filter(user=request.user, category=category)
+
+    for param, lookup in (("since", "date__gte"), ("until", "date__lte")):
+        value = request.query_params.get(param)
+        if not value:
+            continue
+        try:
+            # A bare date first: parse_datetime() would read it as midnight and cut `until` short
+            day = parse_date(value)
+            parsed = parse_datetime(value) if day is None else None
+        except ValueError:
+            day = parsed = None
+        if day is not None:
+            parsed = datetime.combine(day, datetime.max.time() if param == "until" else datetime.min.time())
+        elif parsed is None:
+            raise ValidationError({param: "Use an ISO date or datetime."})
+        if is_naive(parsed):
+            parsed = make_aware(parsed)
+        images = images.filter(**{lookup: parsed})
+
+    return category, images.order_by("date")
+
+
+def image_entry(img, media_url):
+    return {
+        "id": img.id,
+        "date": img.date.isoformat(),
+        "image": media_url(img, img.image.name),
+        "thumbnail": media_url(img, img.thumbnail.name)
+        if img.derivatives_status == ProgressImage.DERIVATIVES_READY else None,
+    }
+
+
+def inline_thumbnails(user, images):
+    """
+    Decrypted thumbnails of images as data: URIs, keyed by image id. Read from
+    the decrypted media cache when present, otherwise fetched and decrypted on
+    a small thread pool. A thumbnail that can't be read is left out; the client
+    falls back to its protected_media URL.
+    """
+    if not images:
+        return {}
+    media = {
+        m.key: m for m in MediaObject.objects.filter(
+            user=user, key__in=[img.thumbnail.name for img in images]
+        ).only("id", "key")
+    }
+
+    def load(img):
+        key = img.thumbnail.name
+        version = media_cache_version(media.get(key))
+        try:
+            cached_path = media_cache.lookup(key, version)
+            if cached_path:
+                with open(cached_path, "rb") as fh:
+                    data = fh.read()
+            else:
+                with img.thumbnail.open("rb") as fh:
+                    data = b"".join(media_cache.fill(key, version, [decrypt_bytes(fh.read(), user)]))
+        except Exception:
+            return None
+        return "data:image/jpeg;base64," + base64.b64encode(data).decode()
+
+    with ThreadPoolExecutor(max_workers=settings.GALLERY_INLINE_WORKERS) as pool:
+        loaded = dict(zip((img.id for img in images), pool.map(load, images)))
+    return {image_id: uri for image_id, uri in loaded.items() if uri}
+
+
 class UserCategoryProgressView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def list(self, request, *args, **kwargs):
-        username = self.kwargs['username']
-        category_name = self.kwargs['category_name']
+        _, images = category_images(request, self.kwargs['username'], self.kwargs['category_name'])
 
-        if request.user.username != username:
-            raise PermissionDenied("You are not allowed to view another user's progress.")
+        def media_url(img, name):
+            return request.build_absolute_uri(reverse("protected_media", args=[name]))
 
-        category = get_object_or_404(Category, name__iexact=category_name)
+        return Response({"images": [image_entry(img, media_url) for img in images]})
 
-        images = ProgressImage.objects.filter(
-            user=request.user,
-            category=category
-        ).order_by('date')
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def media_cache_stats(request):
+    """
+    Decrypted media cache counters of the process serving this request
+    (hits, misses, writes, evictions) and the cache size it last measured.
+    """
+    stats = media_cache.snapshot()
+    lookups = stats.get("hits", 0) + stats.get("misses", 0)
+    return Response({
+        "enabled": media_cache.enabled,
+        "pid": os.getpid(),
+        **stats,
+        "hit_rate": round(stats.get("hits", 0) / lookups, 4) if lookups else None,
+    })
+
+
+class GalleryManifestView(APIView):
+    """
+    Everything the app needs to lay out a category gallery in one response.
+
+    Public images get signed storage URLs directly. Private ones are encrypted
+    at rest, so they point at protected_media, and the first
+    GALLERY_INLINE_THUMBNAILS of their thumbnails are embedded as
+    `thumbnail_data` so the top of the grid renders without a request per
+    image; the rest have `thumbnail_data` null and load lazily. Accepts the same `since` / `until`
+    filters as the category progress view.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, username, category_name):
+        category, images = category_images(request, username, category_name)
+        images = list(images.only("id", "date", "is_public", "image", "thumbnail", "derivatives_status"))
+
+        expires = settings.GALLERY_URL_EXPIRES
+
+        def media_url(img, name):
+            if img.is_public:
+                return generate_signed_url(name, expires=expires)
+            return request.build_absolute_uri(reverse("protected_media", args=[name]))
+
+        inline = inline_thumbnails(request.user, [
+            img for img in images
+            if not img.is_public and img.derivatives_status == ProgressImage.DERIVATIVES_READY
+        ][:settings.GALLERY_INLINE_THUMBNAILS])
 
         image_data = [
             {
-                "id": img.id,
-                "image": request.build_absolute_uri(
-                    reverse("protected_media", args=[img.image.name])
-                ),
-                "date": img.date.isoformat()
+                **image_entry(img, media_url),
+                "is_public": img.is_public,
+                "thumbnail_data": inline.get(img.id),
             }
             for img in images
         ]
 
-        return Response({"images": image_data})
+        return Response({
+            "category": category.name,
+            "expires_in": expires,
+            "images": image_data,
+        })
 
 
 # =========================
@@ -209,6 +427,49 @@ class ProgressImageCreateView(generics.CreateAPIView):
     serializer_class = ProgressImageSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Authenticated and the body not read yet: encrypt the image into storage as it arrives
+        field = ProgressImage._meta.get_field("image")
+        if settings.STREAMING_UPLOADS and writes_to_bucket(field.storage):
+            request.upload_handlers.insert(0, EncryptingUploadHandler(request, request.user, field))
+
+    def create(self, request, *args, **kwargs):
+        image = request.FILES.get("image")
+        try:
+            duplicate = self.find_duplicate(image)
+            if duplicate:
+                # Same photo uploaded again (or a retried request): hand back the existing row
+                return Response(self.get_serializer(duplicate).data, status=status.HTTP_200_OK)
+            return super().create(request, *args, **kwargs)
+        except Exception:
+            if isinstance(image, StoredUpload):
+                image.discard()
+            raise
+        finally:
+            # Only the last `image` part is used; any other would be left an open multipart upload
+            for unused in request.FILES.getlist("image"):
+                if unused is not image and isinstance(unused, StoredUpload):
+                    unused.discard()
+
+    def find_duplicate(self, image):
+        self.content_hash = getattr(image, "content_hash", "")
+        category_name = self.request.data.get("category")
+        category = category_name and Category.objects.filter(name__iexact=category_name).first()
+        if not category:
+            return None  # perform_create reports it
+        if isinstance(image, StoredUpload):
+            return image.check_duplicate(self.request.user, category)
+        if not image or not (image.content_type or "").startswith("image/"):
+            return None
+        # Before anything is encrypted or uploaded
+        hasher = content_hasher(self.request.user)
+        for chunk in image.chunks():
+            hasher.update(chunk)
+        image.seek(0)
+        self.content_hash = hasher.hexdigest()
+        return find_duplicate(self.request.user, category, self.content_hash)
+
     def perform_create(self, serializer):
         request = self.request
         image = request.FILES.get("image")
@@ -228,6 +489,19 @@ class ProgressImageCreateView(generics.CreateAPIView):
         except Category.DoesNotExist:
             raise ValidationError({"category": "Invalid category."})
 
+        if isinstance(image, StoredUpload):
+            # Encrypted and sent while the request was read; not a duplicate, so keep it
+            if image.complete().wait().error:
+                raise ValidationError({"image": image.error})
+            serializer.save(
+                user=request.user,
+                category=category,
+                image=image.key,
+                is_public=False,
+                content_hash=self.content_hash
+            )
+            return
+
         # 🔐 READ ORIGINAL IMAGE BYTES
         original_bytes = image.read()
 
@@ -245,8 +519,233 @@ class ProgressImageCreateView(generics.CreateAPIView):
             user=request.user,
             category=category,
             image=encrypted_file,
-            is_public=False
+            is_public=False,
+            content_hash=self.content_hash
+        )
+
+class ProgressImageBatchCreateView(APIView):
+    """
+    Uploads many images to one category in a single request.
+
+    multipart fields: `category`, `images` (repeated) and optionally `dates`
+    (ISO datetimes, one per image). Files are encrypted and uploaded as they
+    arrive, each finishing in the background while the next one is read; only
+    the uploads that are kept get completed, and their rows are inserted with
+    one bulk_create. Returns a result per image;
+    images the user already has return the existing row with `duplicate`.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        field = ProgressImage._meta.get_field("image")
+        if settings.STREAMING_UPLOADS and writes_to_bucket(field.storage):
+            request.upload_handlers.insert(0, EncryptingUploadHandler(
+                request, request.user, field, field_names=("images",), defer_complete=True,
+            ))
+
+    def post(self, request):
+        files = request.FILES.getlist("images")
+        try:
+            return self.create_images(request, files)
+        except Exception:
+            for f in files:
+                if isinstance(f, StoredUpload):
+                    f.discard()
+            raise
+
+    def create_images(self, request, files):
+        if not files:
+            raise ValidationError({"images": "No image files provided."})
+        if len(files) > settings.BATCH_UPLOAD_MAX_FILES:
+            raise ValidationError({"images": f"At most {settings.BATCH_UPLOAD_MAX_FILES} images per request."})
+
+        category_name = request.data.get("category")
+        if not category_name:
+            raise ValidationError({"category": "Category is required."})
+        try:
+            category = Category.objects.get(name__iexact=category_name)
+        except Category.DoesNotExist:
+            raise ValidationError({"category": "Invalid category."})
+
+        dates = request.data.getlist("dates") if hasattr(request.data, "getlist") else []
+        if dates and len(dates) != len(files):
+            raise ValidationError({"dates": "Give one date per image, or none."})
+
+        # Files the upload handler didn't take (it wasn't installed, or the body was already parsed)
+        field = ProgressImage._meta.get_field("image")
+        files = [
+            f if isinstance(f, StoredUpload) else stage_file(f, request.user, field, category)
+            for f in files
+        ]
+
+        results = []
+        accepted = []
+        seen = {}
+        # Duplicates and rejects are dropped before their uploads are completed
+        for index, upload in enumerate(files):
+            upload.wait()
+            if upload.check_duplicate(request.user, category):
+                results.append({
+                    "index": index, "name": upload.name, "id": upload.duplicate.id,
+                    "date": upload.duplicate.date.isoformat(), "duplicate": True,
+                })
+                continue
+            if upload.key and upload.content_hash in seen:
+                # Sent twice in this request; only the first copy is kept
+                upload.discard()
+                results.append({"index": index, "name": upload.name, "duplicate_of": seen[upload.content_hash]})
+                continue
+            date = now()
+            if dates:
+                date = parse_datetime(dates[index])
+                if date is None:
+                    upload.discard()
+                    upload.error = "Invalid date."
+                elif is_naive(date):
+                    date = make_aware(date)
+            if upload.error:
+                results.append({"index": index, "name": upload.name, "error": upload.error})
+                continue
+            seen[upload.content_hash] = index
+            accepted.append((index, upload.complete(), date))
+
+        images = []
+        for index, upload, date in accepted:
+            if upload.wait().error:
+                results.append({"index": index, "name": upload.name, "error": upload.error})
+                continue
+            images.append((index, upload, ProgressImage(
+                user=request.user, category=category, image=upload.key, date=date, is_public=False,
+                content_hash=upload.content_hash,
+            )))
+
+        with transaction.atomic():
+            created = ProgressImage.objects.bulk_create([img for _, _, img in images])
+            # bulk_create skips post_save, so register the keys here
+            MediaObject.objects.bulk_create([
+                MediaObject(
+                    key=img.image.name, user=request.user, kind=MediaObject.KIND_IMAGE,
+                    size=upload.size, progress_image=img,
+                )
+                for (_, upload, _), img in zip(images, created)
+            ])
+
+        for (index, upload, _), img in zip(images, created):
+            results.append({"index": index, "name": upload.name, "id": img.id, "date": img.date.isoformat()})
+        results.sort(key=lambda r: r["index"])
+
+        failed = sum(1 for r in results if "error" in r)
+        if failed == len(results):
+            status_code = status.HTTP_400_BAD_REQUEST
+        elif failed:
+            status_code = status.HTTP_207_MULTI_STATUS
+        elif created:
+            status_code = status.HTTP_201_CREATED
+        else:
+            status_code = status.HTTP_200_OK
+        return Response({"created": len(created), "results": results}, status=status_code)
+
+
+# =========================
+# Resumable uploads
+# =========================
+class UploadSessionCreateView(APIView):
+    """
+    Starts a resumable image upload: POST category, file_name, content_type,
+    size (bytes) and optionally date. The client then PUTs chunk_size pieces to
+    upload_url with Content-Range headers, in any order and retrying only what
+    failed, and finally POSTs to complete_url.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        category_name = request.data.get("category")
+        if not category_name:
+            raise ValidationError({"category": "Category is required."})
+        try:
+            category = Category.objects.get(name__iexact=category_name)
+        except Category.DoesNotExist:
+            raise ValidationError({"category": "Invalid category."})
+
+        content_type = request.data.get("content_type") or ""
+        if not content_type.startswith("image/"):
+            raise ValidationError({"content_type": "Only image files are allowed."})
+
+        try:
+            size = int(request.data.get("size"))
+        except (TypeError, ValueError):
+            raise ValidationError({"size": "Size in bytes is required."})
+        if not 0 < size <= settings.RESUMABLE_UPLOAD_MAX_SIZE:
+            raise ValidationError({"size": f"Size must be between 1 and {settings.RESUMABLE_UPLOAD_MAX_SIZE} bytes."})
+
+        date = None
+        if request.data.get("date"):
+            date = parse_datetime(request.data["date"])
+            if date is None:
+                raise ValidationError({"date": "Use an ISO datetime."})
+            if is_naive(date):
+                date = make_aware(date)
+
+        session = UploadSession.objects.create(
+            user=request.user,
+            category=category,
+            file_name=os.path.basename(request.data.get("file_name") or "upload.jpg"),
+            content_type=content_type,
+            size=size,
+            chunk_size=settings.RESUMABLE_UPLOAD_CHUNK_SIZE,
+            date=date,
         )
+        return Response({
+            **session_status(session),
+            "upload_url": request.build_absolute_uri(reverse("upload-session", args=[session.id])),
+            "complete_url": request.build_absolute_uri(reverse("upload-session-complete", args=[session.id])),
+        }, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionView(APIView):
+    """
+    GET: which byte ranges are still missing. PUT: one chunk as the raw request body.
+    DELETE: abandon the upload.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_session(self, request, upload_id):
+        return get_object_or_404(UploadSession.objects.select_related("user"), id=upload_id, user=request.user)
+
+    def get(self, request, upload_id):
+        return Response(session_status(self.get_session(request, upload_id)))
+
+    def put(self, request, upload_id):
+        session = self.get_session(request, upload_id)
+        try:
+            index = parse_chunk_range(session, request.headers.get("Content-Range"))
+            store_chunk(session, index, request.stream or io.BytesIO())
+        except UploadError as exc:
+            return Response({"detail": exc.detail}, status=exc.status)
+        return Response(session_status(session))
+
+    def delete(self, request, upload_id):
+        discard_session(self.get_session(request, upload_id))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadSessionCompleteView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, upload_id):
+        session = get_object_or_404(
+            UploadSession.objects.select_related("user", "category"), id=upload_id, user=request.user
+        )
+        try:
+            img, created = assemble(session)
+        except UploadError as exc:
+            return Response({"detail": exc.detail, **session_status(session)}, status=exc.status)
+        return Response(
+            ProgressImageSerializer(img, context={"request": request}).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
 
 # =========================
 # Register
@@ -264,125 +763,162 @@ class CreateProgressVideoView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
-        if not request.user.is_premium:
-            week_ago = now() - timedelta(days=7)
-            videos_last_week = ProgressVideo.objects.filter(
-                user=request.user,
-                created_at__gte=week_ago
-            ).count()
-            if videos_last_week >= 10:
-                return Response(
-                    {"detail": "Free users can only create up to 10 videos per week."},
-                    status=403
-                )
-
         category_name = request.data.get("category")
-        start_index = int(request.data.get("start_index", 0))
-        end_index = int(request.data.get("end_index", -1))
-        fps = float(request.data.get("fps", 2.0))
-        width = request.data.get("width")
-        height = request.data.get("height")
         order = (request.data.get("order") or "oldest").lower()
+        hls = str(request.data.get("hls", "")).lower() in ("1", "true", "yes")
 
         if not category_name:
             return Response({"detail": "category is required"}, status=400)
 
+        try:
+            start_index = int(request.data.get("start_index", 0))
+            end_index = int(request.data.get("end_index", -1))
+            fps = float(request.data.get("fps", 2.0))
+            width = int(request.data["width"]) if request.data.get("width") else None
+            height = int(request.data["height"]) if request.data.get("height") else None
+        except (TypeError, ValueError):
+            return Response({"detail": "start_index, end_index, width and height must be integers and fps a number"}, status=400)
+
+        if not 0 < fps <= settings.RENDER_MAX_FPS:
+            return Response({"detail": f"fps must be > 0 and at most {settings.RENDER_MAX_FPS}"}, status=400)
+        if width is not None and not 0 < width <= settings.RENDER_MAX_WIDTH:
+            return Response({"detail": f"width must be between 1 and {settings.RENDER_MAX_WIDTH}"}, status=400)
+        if height is not None and not 0 < height <= settings.RENDER_MAX_HEIGHT:
+            return Response({"detail": f"height must be between 1 and {settings.RENDER_MAX_HEIGHT}"}, status=400)
+
         category = get_object_or_404(Category, name__iexact=category_name)
 
-        qs = ProgressImage.objects.filter(user=request.user, category=category)
-        qs = qs.order_by("-date" if order == "newest" else "date")
-        images = list(qs)
-        if not images:
-            return Response({"detail": "No images found in this category."}, status=400)
-
-        n = len(images)
-        if end_index < 0 or end_index >= n:
-            end_index = n - 1
-        start_index = max(0, min(start_index, n - 1))
-        end_index = max(0, min(end_index, n - 1))
-        if start_index > end_index:
-            return Response({"detail": "start_index must be <= end_index"}, status=400)
-
-        img_paths = []
-        temp_files = []
-        start_date = images[start_index].date
-        end_date = images[end_index].date
-
-        for img in images[start_index:end_index + 1]:
-            # Generate temp file to decrypt locally
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(img.image.name)[1])
-            decrypt_file(img.image.path, request.user, tmp.name)
-            img_paths.append(tmp.name)
-            temp_files.append(tmp.name)
-
-        if fps <= 0:
-            return Response({"detail": "fps must be > 0"}, status=400)
-
-        user_folder = os.path.join("progress_videos", str(request.user.id))
-        os.makedirs(user_folder, exist_ok=True)
-
-        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
-        out_name = f"{stamp}_{uuid.uuid4().hex[:8]}.mp4"
-        out_path = os.path.join(user_folder, out_name)
-
-        duration = 1.0 / fps
-        clips = []
+        params = {
+            "start_index": start_index,
+            "end_index": end_index,
+            "fps": fps,
+            "width": width,
+            "height": height,
+            "order": order,
+            "hls": hls,
+        }
         try:
-            for p in img_paths:
-                clip = ImageClip(p).with_duration(duration)
-                if width and height:
-                    clip = clip.resize(newsize=(int(width), int(height)))
-                clips.append(clip)
-
-            final = concatenate_videoclips(clips, method="compose")
-            final.write_videofile(
-                out_path,
-                fps=max(1, int(round(fps))),
-                codec="libx264",
-                audio=False,
-                logger=None
+            frames = select_frames(request.user, category, params)
+        except RenderError as exc:
+            return Response({"detail": str(exc)}, status=400)
+
+        # Identical request already rendered → hand back the existing video
+        cached = find_cached_video(request.user, render_cache_key(frames, params))
+        if cached:
+            job = VideoRenderJob.objects.create(
+                user=request.user,
+                category=category,
+                params=params,
+                status=VideoRenderJob.STATUS_DONE,
+                video=cached,
+                result=render_result(frames, fps),
+                finished_at=now(),
             )
-            final.close()
-        finally:
-            for c in clips:
-                try:
-                    c.close()
-                except Exception:
-                    pass
-            for tmp_path in temp_files:
-                try:
-                    os.remove(tmp_path)
-                except Exception:
-                    pass
-
-        rel_path = os.path.join(user_folder, out_name).replace("\\", "/")
-
-        progress_video = ProgressVideo.objects.create(
-            user=request.user,
-            category=category,
-            video=rel_path,
-            is_public=False,
-            fps=fps,
-            start_date=start_date,
-            end_date=end_date
+            return Response(render_job_payload(request, job))
+
+        try:
+            # One transaction: a failure before the job exists must not keep the reserved slot
+            with transaction.atomic():
+                admit_render(request.user)
+                # Rendering happens in `manage.py run_render_worker`, never in the web worker
+                job = VideoRenderJob.objects.create(
+                    user=request.user,
+                    category=category,
+                    params=params,
+                )
+        except RenderRejected as exc:
+            response = Response({"detail": exc.detail}, status=exc.status)
+            if exc.retry_after:
+                response["Retry-After"] = str(exc.retry_after)
+            return response
+
+        return Response({
+            "message": "Video render queued.",
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": request.build_absolute_uri(
+                reverse("progress-video-job", args=[job.id])
+            ),
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+def render_job_payload(request, job):
+    data = {
+        "job_id": job.id,
+        "status": job.status,
+        "created_at": job.created_at.isoformat(),
+    }
+    if job.status == VideoRenderJob.STATUS_DONE and job.video:
+        data["message"] = "Video created successfully!"
+        data["video_url"] = request.build_absolute_uri(
+            reverse("protected_media", args=[job.video.video.name])
         )
+        if job.video.hls_renditions:
+            data["hls_url"] = request.build_absolute_uri(
+                reverse("progress-video-hls", args=[job.video.id])
+            )
+        data.update(job.result)
+    elif job.status == VideoRenderJob.STATUS_FAILED:
+        data["detail"] = job.error
+    return data
+
 
-        encrypt_file(out_path, request.user)
+class ProgressVideoJobView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
 
-        video_url = request.build_absolute_uri(reverse("protected_media", args=[rel_path]))
+    def get(self, request, job_id):
+        job = get_object_or_404(VideoRenderJob, id=job_id, user=request.user)
+        return Response(render_job_payload(request, job))
 
-        total_frames = len(img_paths)
-        total_seconds = total_frames * duration
 
-        return Response({
-            "message": "Video created successfully!",
-            "video_url": video_url,
-            "count": total_frames,
-            "duration_s": round(total_seconds, 2),
-            "fps": fps,
-            "start_date": start_date.strftime('%Y-%m-%d %H:%M:%S'),
-            "end_date": end_date.strftime('%Y-%m-%d %H:%M:%S'),
-        })
+# =========================
+# Progress video HLS
+# =========================
+HLS_CONTENT_TYPE = "application/vnd.apple.mpegurl"
+
+
+class ProgressVideoHLSView(APIView):
+    """
+    Master playlist, or a rendition's media playlist with freshly signed segment URLs.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, video_id, rendition=None):
+        video = get_object_or_404(ProgressVideo, id=video_id, user=request.user)
+        if not video.hls_renditions:
+            raise Http404("This video has no HLS output.")
+
+        if rendition is None:
+            playlist = master_playlist(
+                video,
+                lambda name: request.build_absolute_uri(
+                    reverse("progress-video-hls-rendition", args=[video.id, name])
+                ),
+            )
+        else:
+            match = next((r for r in video.hls_renditions if r["name"] == rendition), None)
+            if match is None:
+                raise Http404("Unknown rendition.")
+            playlist = media_playlist(
+                match,
+                request.build_absolute_uri(reverse("progress-video-hls-key", args=[video.id])),
+            )
+
+        response = HttpResponse(playlist, content_type=HLS_CONTENT_TYPE)
+        response["Cache-Control"] = "private, no-store"
+        return response
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def progress_video_hls_key(request, video_id):
+    video = get_object_or_404(ProgressVideo, id=video_id, user=request.user)
+    if not video.hls_key:
+        raise Http404("This video has no HLS output.")
+
+    response = HttpResponse(hls_key(video), content_type="application/octet-stream")
+    response["Cache-Control"] = "private, no-store"
+    return response
 
 
 # =========================
@@ -423,10 +959,16 @@ def delete_progress_image(request, image_id):
     if progress_image.user != request.user:
         return Response({"detail": "You do not have permission to delete this image."}, status=403)
 
-    try:
-        s3.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=progress_image.image.name)
-    except Exception:
-        pass
+    for field in (progress_image.image, progress_image.thumbnail, progress_image.video_frame, progress_image.original):
+        if not field:
+            continue
+        try:
+            get_s3_client().delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=field.name)
+        except Exception:
+            pass
+
+    for media in progress_image.media_objects.only("id", "key"):
+        media_cache.discard(media.key, media_cache_version(media))
 
     progress_image.delete()
     return Response({"message": "Progress image deleted successfully."}, status=200)
@@ -7,6 +7,7 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 import dj_database_url
+from botocore.config import Config
 
 # ======================
 # Paths & env
@@ -62,6 +63,7 @@ INSTALLED_APPS = [
     "storages",
 
     # My apps
+    "api",
     "progress_tracking",
     "user",
     "core",
@@ -174,7 +176,11 @@ STATIC_URL = "/static/"
 # MEDIA — WASABI ONLY (NO LOCAL STORAGE)
 # ======================
 
-DEFAULT_FILE_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
+# DEFAULT_FILE_STORAGE is ignored since Django 5.1; FileFields read and write through STORAGES["default"]
+STORAGES = {
+    "default": {"BACKEND": "storages.backends.s3.S3Storage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
 
 AWS_ACCESS_KEY_ID = os.getenv("WASABI_ACCESS_KEY")
 AWS_SECRET_ACCESS_KEY = os.getenv("WASABI_SECRET_KEY")
@@ -191,11 +197,156 @@ AWS_DEFAULT_ACL = None
 AWS_S3_FILE_OVERWRITE = False
 AWS_S3_VERIFY = True
 
-INSTALLED_APPS += ["storages"]
+# Client settings for both api.utils.wasabi's shared client and the default storage
+# (django-storages reads AWS_S3_CLIENT_CONFIG)
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+AWS_S3_CLIENT_CONFIG = Config(
+    s3={"addressing_style": AWS_S3_ADDRESSING_STYLE},
+    signature_version=AWS_S3_SIGNATURE_VERSION,
+    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+    retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "standard"},
+    connect_timeout=5,
+    read_timeout=60,
+)
+
+# Progress image uploads are encrypted into S3 multipart uploads while the request
+# body arrives; parts are buffered up to S3_UPLOAD_PART_SIZE (S3 minimum: 5 MiB)
+STREAMING_UPLOADS = os.getenv("STREAMING_UPLOADS", "True") == "True"
+S3_UPLOAD_PART_SIZE = int(os.getenv("S3_UPLOAD_PART_SIZE", str(8 * 1024 * 1024)))
+S3_UPLOAD_THREADS = int(os.getenv("S3_UPLOAD_THREADS", "8"))
+
+# Most images accepted by POST /api/progress/create/batch/
+BATCH_UPLOAD_MAX_FILES = int(os.getenv("BATCH_UPLOAD_MAX_FILES", "50"))
+
+# Resumable uploads (/api/progress/uploads/): chunk size handed to clients, largest
+# accepted file, how long an unfinished session is kept, and after how long a
+# session stuck being assembled (its request died) is purged (purge_upload_sessions)
+RESUMABLE_UPLOAD_CHUNK_SIZE = int(os.getenv("RESUMABLE_UPLOAD_CHUNK_SIZE", str(2 * 1024 * 1024)))
+RESUMABLE_UPLOAD_MAX_SIZE = int(os.getenv("RESUMABLE_UPLOAD_MAX_SIZE", str(100 * 1024 * 1024)))
+RESUMABLE_UPLOAD_EXPIRES = int(os.getenv("RESUMABLE_UPLOAD_EXPIRES", str(24 * 3600)))
+RESUMABLE_UPLOAD_ASSEMBLE_TIMEOUT = int(os.getenv("RESUMABLE_UPLOAD_ASSEMBLE_TIMEOUT", "3600"))
+
+# Presigned URLs are signed for twice the requested lifetime and reused while at
+# least the requested lifetime remains
+SIGNED_URL_CACHE_SIZE = int(os.getenv("SIGNED_URL_CACHE_SIZE", "10000"))
 
 MEDIA_URL = f"https://{AWS_STORAGE_BUCKET_NAME}.s3.eu-central-1.wasabisys.com"
 
 
+# ======================
+# Encryption
+# ======================
+
+# Wraps every per-user key (urlsafe base64, 32 bytes). Required, and kept apart from
+# SECRET_KEY so rotating that doesn't make stored media unrecoverable. Generate with
+# python -c "import base64, os; print(base64.urlsafe_b64encode(os.urandom(32)).decode())"
+ENCRYPTION_MASTER_KEY = os.getenv("ENCRYPTION_MASTER_KEY")
+
+# In-process LRU of unwrapped user keys; the current key version is re-read after the TTL
+USER_KEY_CACHE_SIZE = int(os.getenv("USER_KEY_CACHE_SIZE", "1024"))
+USER_KEY_CACHE_TTL = int(os.getenv("USER_KEY_CACHE_TTL", "300"))
+
+# Plaintext bytes per authenticated chunk for newly encrypted objects
+# (stored in each object's header, so changing it never breaks old objects)
+ENCRYPTION_CHUNK_SIZE = int(os.getenv("ENCRYPTION_CHUNK_SIZE", str(64 * 1024)))
+
+# reencrypt_media: rows per checkpointed batch and re-encryption processes
+REENCRYPT_BATCH_SIZE = int(os.getenv("REENCRYPT_BATCH_SIZE", "200"))
+REENCRYPT_WORKERS = int(os.getenv("REENCRYPT_WORKERS", str(os.cpu_count() or 2)))
+
+# Largest slice protected_media returns for one `Range` request, however much was asked for
+PROTECTED_MEDIA_MAX_RANGE = int(os.getenv("PROTECTED_MEDIA_MAX_RANGE", str(4 * 1024 * 1024)))
+
+# How long clients may reuse a decrypted private image/video without revalidating
+# (it carries an ETag, so a stale copy costs one 304 round trip, not a download)
+PROTECTED_MEDIA_MAX_AGE = int(os.getenv("PROTECTED_MEDIA_MAX_AGE", "86400"))
+
+# Lifetime of the signed URLs in gallery manifests
+GALLERY_URL_EXPIRES = int(os.getenv("GALLERY_URL_EXPIRES", "3600"))
+# Private thumbnails embedded in a manifest (roughly the first screen of the
+# grid; the rest load through protected_media), and the threads fetching them
+GALLERY_INLINE_THUMBNAILS = int(os.getenv("GALLERY_INLINE_THUMBNAILS", "24"))
+GALLERY_INLINE_WORKERS = int(os.getenv("GALLERY_INLINE_WORKERS", "8"))
+
+# Local cache of decrypted media for repeat views (disabled when unset). Holds
+# plaintext, so point it at a private volume. Least recently used entries are
+# evicted past MEDIA_CACHE_MAX_BYTES.
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR")
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+
+# ======================
+# Video rendering
+# ======================
+
+# Seconds an idle render worker sleeps between queue polls
+RENDER_WORKER_POLL_INTERVAL = float(os.getenv("RENDER_WORKER_POLL_INTERVAL", "1.0"))
+
+# A running job older than this is assumed to belong to a dead worker and is retried
+RENDER_JOB_STALE_AFTER = int(os.getenv("RENDER_JOB_STALE_AFTER", "1800"))
+RENDER_JOB_MAX_ATTEMPTS = int(os.getenv("RENDER_JOB_MAX_ATTEMPTS", "3"))
+
+# Admission control for POST /api/progress/video/create/ (429 + Retry-After when exceeded)
+FREE_VIDEOS_PER_WEEK = int(os.getenv("FREE_VIDEOS_PER_WEEK", "10"))
+RENDER_MAX_IN_FLIGHT_PER_USER = int(os.getenv("RENDER_MAX_IN_FLIGHT_PER_USER", "2"))
+RENDER_QUEUE_MAX = int(os.getenv("RENDER_QUEUE_MAX", "200"))
+RENDER_RETRY_AFTER = int(os.getenv("RENDER_RETRY_AFTER", "30"))
+
+# Largest output size and frame rate a render request may ask for
+RENDER_MAX_WIDTH = int(os.getenv("RENDER_MAX_WIDTH", "3840"))
+RENDER_MAX_HEIGHT = int(os.getenv("RENDER_MAX_HEIGHT", "2160"))
+RENDER_MAX_FPS = float(os.getenv("RENDER_MAX_FPS", "60"))
+
+# Concurrent encodes across all render workers on one host (lock files in RENDER_SLOT_DIR)
+RENDER_MAX_CONCURRENT_PER_HOST = int(os.getenv("RENDER_MAX_CONCURRENT_PER_HOST", str(os.cpu_count() or 1)))
+RENDER_SLOT_DIR = os.getenv("RENDER_SLOT_DIR", "/tmp/miloc_render_slots")
+
+# Frames fetched + decrypted concurrently while the encoder runs (1 = sequential),
+# and how many decoded frames may be buffered ahead of the encoder
+RENDER_PREFETCH_WORKERS = int(os.getenv("RENDER_PREFETCH_WORKERS", "8"))
+RENDER_PREFETCH_DEPTH = int(os.getenv("RENDER_PREFETCH_DEPTH", "16"))
+
+# Store renders as encoded segments so a longer timeline only encodes its new frames.
+# Chains reaching RENDER_MAX_SEGMENTS are re-encoded as a single segment.
+RENDER_SEGMENT_CACHE = os.getenv("RENDER_SEGMENT_CACHE", "True") == "True"
+RENDER_MAX_SEGMENTS = int(os.getenv("RENDER_MAX_SEGMENTS", "32"))
+
+# HLS output, produced when a render is requested with "hls": true
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", "4"))
+HLS_RENDITIONS = [
+    {"name": "low", "height": 480, "bitrate": 800_000},
+    {"name": "high", "height": 1080, "bitrate": 3_000_000},
+]
+# Lifetime of the signed segment URLs inside a served playlist
+HLS_URL_EXPIRES = int(os.getenv("HLS_URL_EXPIRES", "3600"))
+
+
+# ======================
+# Image derivatives
+# ======================
+
+# Made for every ProgressImage by `manage.py run_derivative_worker`
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+VIDEO_FRAME_SIZE = (1920, 1080)
+DERIVATIVE_JPEG_QUALITY = int(os.getenv("DERIVATIVE_JPEG_QUALITY", "85"))
+# Image processes run by run_derivative_worker (decoding and encoding is CPU bound)
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "1"))
+# An image processing for longer than this is assumed to belong to a dead worker and is retried
+DERIVATIVE_JOB_STALE_AFTER = int(os.getenv("DERIVATIVE_JOB_STALE_AFTER", "600"))
+DERIVATIVE_JOB_MAX_ATTEMPTS = int(os.getenv("DERIVATIVE_JOB_MAX_ATTEMPTS", "3"))
+
+# Recompression of uploaded originals, done by the derivative worker: EXIF
+# orientation applied, long side capped at INGEST_MAX_DIMENSION and re-encoded
+# as INGEST_FORMAT (WEBP or JPEG), whenever that makes the file smaller
+INGEST_RECOMPRESS = os.getenv("INGEST_RECOMPRESS", "False") == "True"
+INGEST_FORMAT = os.getenv("INGEST_FORMAT", "WEBP").upper()
+INGEST_QUALITY = int(os.getenv("INGEST_QUALITY", "82"))
+INGEST_MAX_DIMENSION = int(os.getenv("INGEST_MAX_DIMENSION", "3072"))
+# Keep the uploaded file as ProgressImage.original instead of deleting it
+INGEST_KEEP_ORIGINAL = os.getenv("INGEST_KEEP_ORIGINAL", "False") == "True"
+
+
 # ======================
 # Auth / user model
 # ======================
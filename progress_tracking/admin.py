@@ -8,4 +8,9 @@ admin.site.register(MaxCategory)
 admin.site.register(MaxData)
 admin.site.register(MaxUnit)
 admin.site.register(ProgressImage)
-admin.site.register(ProgressVideo)
\ No newline at end of file
+admin.site.register(ProgressVideo)
+admin.site.register(VideoRenderJob)
+admin.site.register(VideoSegment)
+admin.site.register(RenderQuota)
+admin.site.register(MediaObject)
+admin.site.register(UploadSession)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ProgressTrackingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'progress_tracking'
+
+    def ready(self):
+        from . import signals  # noqa: F401
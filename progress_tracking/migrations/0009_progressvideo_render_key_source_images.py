@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-16 20:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0008_videorenderjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='progressvideo',
+            name='render_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='progressvideo',
+            name='source_images',
+            field=models.ManyToManyField(blank=True, related_name='progress_videos', to='progress_tracking.progressimage'),
+        ),
+    ]
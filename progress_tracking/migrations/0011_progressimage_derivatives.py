@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-16 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0010_videosegment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='progressimage',
+            name='derivatives_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='progressimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='progress_images/derivatives/'),
+        ),
+        migrations.AddField(
+            model_name='progressimage',
+            name='video_frame',
+            field=models.ImageField(blank=True, null=True, upload_to='progress_images/derivatives/'),
+        ),
+    ]
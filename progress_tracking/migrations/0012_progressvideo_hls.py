@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-16 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0011_progressimage_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='progressvideo',
+            name='hls_key',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='progressvideo',
+            name='hls_renditions',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
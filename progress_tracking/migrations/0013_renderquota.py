@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-16 20:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0012_progressvideo_hls'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderQuota',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('in_flight', models.PositiveIntegerField(default=0)),
+                ('week_started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('week_count', models.PositiveIntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='render_quota', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-16 20:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0013_renderquota'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaObject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('kind', models.CharField(choices=[('image', 'Image'), ('thumbnail', 'Thumbnail'), ('video_frame', 'Video frame'), ('video', 'Video')], max_length=12)),
+                ('is_public', models.BooleanField(default=False)),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('progress_image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='media_objects', to='progress_tracking.progressimage')),
+                ('progress_video', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='media_objects', to='progress_tracking.progressvideo')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_objects', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
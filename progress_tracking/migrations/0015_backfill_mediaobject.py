@@ -0,0 +1,49 @@
+from django.db import migrations
+
+BATCH_SIZE = 2000
+
+FIELDS = {
+    "ProgressImage": ("progress_image", {"image": "image", "thumbnail": "thumbnail", "video_frame": "video_frame"}),
+    "ProgressVideo": ("progress_video", {"video": "video"}),
+}
+
+
+def backfill(apps, schema_editor):
+    MediaObject = apps.get_model("progress_tracking", "MediaObject")
+    for model_name, (parent, fields) in FIELDS.items():
+        model = apps.get_model("progress_tracking", model_name)
+        last_pk = 0
+        while True:
+            rows = list(
+                model.objects.filter(pk__gt=last_pk).order_by("pk")
+                .values("pk", "user_id", "is_public", *fields)[:BATCH_SIZE]
+            )
+            if not rows:
+                break
+            MediaObject.objects.bulk_create(
+                [
+                    MediaObject(
+                        key=row[name],
+                        user_id=row["user_id"],
+                        kind=kind,
+                        is_public=row["is_public"],
+                        **{f"{parent}_id": row["pk"]},
+                    )
+                    for row in rows
+                    for name, kind in fields.items()
+                    if row[name]
+                ],
+                ignore_conflicts=True,
+            )
+            last_pk = rows[-1]["pk"]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0014_mediaobject'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-16 20:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0016_uploadsession'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='progressimage',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='progressimage',
+            index=models.Index(fields=['user', 'content_hash'], name='progress_tr_user_id_1e1690_idx'),
+        ),
+    ]
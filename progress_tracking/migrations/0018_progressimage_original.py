@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-16 20:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0017_progressimage_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='progressimage',
+            name='original',
+            field=models.ImageField(blank=True, null=True, upload_to='progress_images/originals/'),
+        ),
+        migrations.AlterField(
+            model_name='mediaobject',
+            name='kind',
+            field=models.CharField(choices=[('image', 'Image'), ('thumbnail', 'Thumbnail'), ('video_frame', 'Video frame'), ('video', 'Video'), ('original', 'Original')], max_length=12),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-16 21:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0018_progressimage_original'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='progressimage',
+            name='derivatives_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='progressimage',
+            name='derivatives_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
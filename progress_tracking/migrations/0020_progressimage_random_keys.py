@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-16 21:12
+
+import progress_tracking.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0019_progressimage_derivatives_claim'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='progressimage',
+            name='image',
+            field=models.ImageField(upload_to=progress_tracking.models.progress_image_path),
+        ),
+    ]
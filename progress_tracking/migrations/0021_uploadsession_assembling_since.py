@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-16 21:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0020_progressimage_random_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='assembling_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-16 21:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('progress_tracking', '0021_uploadsession_assembling_since'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='progressimage',
+            name='progress_tr_user_id_1e1690_idx',
+        ),
+        migrations.AddIndex(
+            model_name='progressimage',
+            index=models.Index(fields=['user', 'category', 'content_hash'], name='progress_tr_user_id_ad0440_idx'),
+        ),
+    ]
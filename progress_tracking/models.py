@@ -1,9 +1,18 @@
 # progress_tracking/models.py
+import os
+import uuid
+
 from django.db import models
 from django.utils import timezone
 from django.conf import settings
 from user.models import CustomUser
 
+def progress_image_path(instance, filename):
+    # Random names: uploads of the same file name (or concurrent ones) can never collide
+    ext = os.path.splitext(filename)[1].lower()
+    return f"progress_images/{instance.user_id}/{uuid.uuid4().hex}{ext}"
+
+
 class Category(models.Model):
     name = models.CharField(max_length=50, unique=True)
 
@@ -23,9 +32,40 @@ class ProgressImage(models.Model):
         on_delete=models.CASCADE,
         related_name="progress_images"
     )
-    image = models.ImageField(upload_to="progress_images/", blank=False, null=False)
+    image = models.ImageField(upload_to=progress_image_path, blank=False, null=False)
     is_public = models.BooleanField(default=False)
 
+    DERIVATIVES_PENDING = "pending"
+    DERIVATIVES_PROCESSING = "processing"
+    DERIVATIVES_READY = "ready"
+    DERIVATIVES_FAILED = "failed"
+    DERIVATIVES_CHOICES = [
+        (DERIVATIVES_PENDING, "Pending"),
+        (DERIVATIVES_PROCESSING, "Processing"),
+        (DERIVATIVES_READY, "Ready"),
+        (DERIVATIVES_FAILED, "Failed"),
+    ]
+
+    # Small, EXIF-oriented copies made by `manage.py run_derivative_worker`
+    thumbnail = models.ImageField(upload_to="progress_images/derivatives/", blank=True, null=True)
+    video_frame = models.ImageField(upload_to="progress_images/derivatives/", blank=True, null=True)
+    # The file as uploaded, when recompression replaced `image` and INGEST_KEEP_ORIGINAL is set
+    original = models.ImageField(upload_to="progress_images/originals/", blank=True, null=True)
+    derivatives_status = models.CharField(
+        max_length=10,
+        choices=DERIVATIVES_CHOICES,
+        default=DERIVATIVES_PENDING,
+        db_index=True
+    )
+    # Claim time and number of claims, for reclaiming images whose worker died
+    derivatives_started_at = models.DateTimeField(null=True, blank=True)
+    derivatives_attempts = models.PositiveSmallIntegerField(default=0)
+    # Keyed hash of the plaintext (api.utils.encryption.content_hasher), for spotting re-uploads
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "category", "content_hash"])]
+
     def __str__(self):
         return f"{self.user.username} - {self.category.name} - {self.date.strftime('%Y-%m-%d')}"
 
@@ -48,6 +88,17 @@ class ProgressVideo(models.Model):
     start_date = models.DateTimeField(null=True, blank=True)  # Date of the first image
     end_date = models.DateTimeField(null=True, blank=True)  # Date of the last image
     created_at = models.DateTimeField(auto_now_add=True) 
+    # Hash of the ordered source image ids + render params, for reusing identical renders
+    render_key = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    source_images = models.ManyToManyField(
+        "ProgressImage",
+        blank=True,
+        related_name="progress_videos"
+    )
+    # HLS output: AES-128 segment key (encrypted with the owner's key) and
+    # [{"name", "bandwidth", "resolution", "playlist"}] per rendition
+    hls_key = models.TextField(blank=True)
+    hls_renditions = models.JSONField(default=list, blank=True)
 
     def __str__(self):
         # Safely handle None values for start_date and end_date
@@ -89,3 +140,201 @@ class MaxData(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.category.name} - {self.date.strftime('%Y-%m-%d')}"
+
+
+class VideoRenderJob(models.Model):
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="video_render_jobs"
+    )
+    category = models.ForeignKey(
+        "Category",
+        on_delete=models.CASCADE,
+        related_name="video_render_jobs"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    params = models.JSONField(default=dict, blank=True)  # start_index, end_index, fps, width, height, order
+    result = models.JSONField(default=dict, blank=True)  # count, duration_s, ... once done
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    video = models.ForeignKey(
+        "ProgressVideo",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="render_jobs"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.category.name} - {self.status}"
+
+
+class VideoSegment(models.Model):
+    """
+    An encoded run of timeline frames. Segments chain through `previous`, so a
+    render whose frames extend an earlier one only encodes the new frames.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="video_segments"
+    )
+    category = models.ForeignKey(
+        "Category",
+        on_delete=models.CASCADE,
+        related_name="video_segments"
+    )
+    previous = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="next_segments"
+    )
+    # Hash of the render params + every frame id from the chain start to the end of this segment
+    chain_key = models.CharField(max_length=64, db_index=True)
+    file = models.FileField(upload_to="progress_videos/segments/")
+    frame_count = models.PositiveIntegerField()
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.category.name} - {self.frame_count} frames"
+
+
+class RenderQuota(models.Model):
+    """
+    Per-user render counters, updated atomically on admission and completion so
+    the create endpoint never has to count videos or jobs.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="render_quota"
+    )
+    in_flight = models.PositiveIntegerField(default=0)  # queued + running jobs
+    week_started_at = models.DateTimeField(default=timezone.now)
+    week_count = models.PositiveIntegerField(default=0)  # renders admitted in the current week
+
+    def __str__(self):
+        return f"{self.user.username} - {self.in_flight} in flight - {self.week_count} this week"
+
+
+class MediaObject(models.Model):
+    """
+    One row per stored media key, so protected_media can resolve owner and
+    visibility with a single unique-index lookup. Kept in sync with
+    ProgressImage/ProgressVideo by signals; rows go away with their parent.
+    """
+    KIND_IMAGE = "image"
+    KIND_THUMBNAIL = "thumbnail"
+    KIND_VIDEO_FRAME = "video_frame"
+    KIND_VIDEO = "video"
+    KIND_ORIGINAL = "original"
+    KIND_CHOICES = [
+        (KIND_IMAGE, "Image"),
+        (KIND_THUMBNAIL, "Thumbnail"),
+        (KIND_VIDEO_FRAME, "Video frame"),
+        (KIND_VIDEO, "Video"),
+        (KIND_ORIGINAL, "Original"),
+    ]
+
+    key = models.CharField(max_length=255, unique=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="media_objects"
+    )
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    is_public = models.BooleanField(default=False)
+    size = models.BigIntegerField(null=True, blank=True)  # stored (encrypted) bytes, when known
+    progress_image = models.ForeignKey(
+        "ProgressImage",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="media_objects"
+    )
+    progress_video = models.ForeignKey(
+        "ProgressVideo",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="media_objects"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.kind} - {self.key}"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload: the client PUTs fixed-size chunks at their offsets in any
+    order (retrying only what failed), then asks for it to be assembled into a
+    ProgressImage. Chunks are kept encrypted in storage until then.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="upload_sessions"
+    )
+    category = models.ForeignKey(
+        "Category",
+        on_delete=models.CASCADE,
+        related_name="upload_sessions"
+    )
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    date = models.DateTimeField(null=True, blank=True)
+    assembling = models.BooleanField(default=False)  # claimed by a complete request
+    assembling_since = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def __str__(self):
+        return f"{self.user.username} - {self.file_name} ({self.size} bytes)"
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(
+        "UploadSession",
+        on_delete=models.CASCADE,
+        related_name="chunks"
+    )
+    index = models.PositiveIntegerField()
+    key = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [("session", "index")]
+
+    def __str__(self):
+        return f"{self.session_id} #{self.index}"
@@ -0,0 +1,83 @@
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import MediaObject, ProgressImage, ProgressVideo, VideoSegment
+
+logger = logging.getLogger(__name__)
+
+# Stored file fields registered in MediaObject, per model
+MEDIA_FIELDS = {
+    ProgressImage: {
+        "image": MediaObject.KIND_IMAGE,
+        "thumbnail": MediaObject.KIND_THUMBNAIL,
+        "video_frame": MediaObject.KIND_VIDEO_FRAME,
+        "original": MediaObject.KIND_ORIGINAL,
+    },
+    ProgressVideo: {"video": MediaObject.KIND_VIDEO},
+}
+
+
+@receiver(pre_delete, sender=ProgressImage)
+def invalidate_cached_videos(sender, instance, **kwargs):
+    # A video showing a deleted photo must not be handed out as a cached render
+    ProgressVideo.objects.filter(source_images=instance).update(render_key=None)
+
+
+@receiver(pre_delete, sender=ProgressImage)
+def invalidate_video_segments(sender, instance, **kwargs):
+    # Segment chains are per category timeline; rebuilding them is cheaper than tracking membership
+    segments = VideoSegment.objects.filter(user_id=instance.user_id, category_id=instance.category_id)
+    for segment in segments:
+        segment.file.delete(save=False)
+    segments.delete()
+
+
+def known_size(field_file):
+    # Only when the content is still in hand (just uploaded); never a storage request
+    content = getattr(field_file, "_file", None)
+    return getattr(content, "size", None) if content is not None else None
+
+
+@receiver(post_save, sender=ProgressImage)
+@receiver(post_save, sender=ProgressVideo)
+def sync_media_objects(sender, instance, update_fields=None, **kwargs):
+    fields = MEDIA_FIELDS[sender]
+    if update_fields is not None and not ({"is_public", *fields} & set(update_fields)):
+        return
+
+    parent_field = "progress_image" if sender is ProgressImage else "progress_video"
+    parent = {parent_field: instance}
+    keys = []
+    for name, kind in fields.items():
+        field_file = getattr(instance, name)
+        if not field_file:
+            continue
+        keys.append(field_file.name)
+        values = {"user_id": instance.user_id, "kind": kind, "is_public": instance.is_public, **parent}
+        size = known_size(field_file)
+        if size is not None:
+            values["size"] = size
+
+        media = MediaObject.objects.filter(key=field_file.name).first()
+        if media is None:
+            try:
+                with transaction.atomic():
+                    MediaObject.objects.create(key=field_file.name, **values)
+                continue
+            except IntegrityError:
+                media = MediaObject.objects.get(key=field_file.name)  # registered concurrently
+
+        # A key is only ever updated for the row that registered it, never handed to another owner
+        if media.user_id != instance.user_id or getattr(media, f"{parent_field}_id") != instance.pk:
+            logger.error(
+                "%s %s references %s, which is registered to user %s (media object %s); not taking it over",
+                sender.__name__, instance.pk, field_file.name, media.user_id, media.pk,
+            )
+            continue
+        MediaObject.objects.filter(pk=media.pk).update(**values)
+
+    # Keys replaced by this save
+    MediaObject.objects.filter(**parent).exclude(key__in=keys).delete()
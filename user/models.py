@@ -58,7 +58,29 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
             # generate a key if missing (legacy users)
             self.encryption_key = Fernet.generate_key().decode()
             self.save(update_fields=["encryption_key"])
-        return Fernet(self.encryption_key.encode())
+        # Reuse across calls on the same instance (batch decrypts of a user's images)
+        cached = getattr(self, "_fernet", None)
+        if cached is None or cached[0] != self.encryption_key:
+            cached = (self.encryption_key, Fernet(self.encryption_key.encode()))
+            self._fernet = cached
+        return cached[1]
 
     def __str__(self):
         return self.username
+
+
+class UserKey(models.Model):
+    """
+    A version of a user's key-encryption key, stored wrapped by the server master key.
+    Object data keys are wrapped by one of these; the highest version is used for new objects.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="keys")
+    version = models.PositiveIntegerField()
+    wrapped_key = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [("user", "version")]
+
+    def __str__(self):
+        return f"{self.user.username} - key v{self.version}"